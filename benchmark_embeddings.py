@@ -0,0 +1,116 @@
+"""Benchmark the embedding backends on this machine.
+
+Measures model load time, bulk encode throughput and single-query latency
+(p50/p95) for each backend, e.g.:
+
+    python benchmark_embeddings.py --backends onnx onnx-int8 --threads 4
+"""
+
+from embeddings import BACKENDS, ONNX_MODEL_NAME, create_embedding_function
+import argparse
+import itertools
+import json
+import random
+import statistics
+import time
+from config import EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, EMBEDDING_THREADS
+
+WORDS = (
+    "the model context memory session vector search query user assistant message history "
+    "python error timeout database embedding token latency server request response chunk "
+    "index score recent summary config thread batch cache file function return value"
+).split()
+
+
+def synthetic_texts(count, seed=0):
+    """Texts of mixed length, from a few words up to a few paragraphs, like chat turns"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        length = int(rng.lognormvariate(3.0, 1.0)) + 3
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(min(length, 600))))
+    return texts
+
+
+def stored_texts(count):
+    """Up to count documents from the vector store"""
+    from vector_store import VectorStore
+    records = VectorStore().iter_records(include=("documents",))
+    return [record['document'] for record in itertools.islice(records, count)]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def benchmark(backend, texts, queries, model_name, threads, batch_size):
+    if backend != "sentence-transformers":
+        model_name = ONNX_MODEL_NAME
+    options = {} if backend == "default" else {"threads": threads, "batch_size": batch_size}
+    start = time.perf_counter()
+    function = create_embedding_function(backend, model_name, **options)
+    function(["warm up"])  # Downloads and loads the model
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    function(texts)
+    bulk_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        function([query])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "backend": backend,
+        "model": function.model_name,
+        "load_s": round(load_seconds, 3),
+        "texts_per_s": round(len(texts) / bulk_seconds, 1),
+        "query_p50_ms": round(statistics.median(latencies), 2),
+        "query_p95_ms": round(percentile(latencies, 0.95), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backend throughput and latency")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS),
+                        help="Backends to compare (default: all)")
+    parser.add_argument("--model", default=EMBEDDING_MODEL,
+                        help=f"Model for the sentence-transformers backend (default: {EMBEDDING_MODEL})")
+    parser.add_argument("--texts", type=int, default=1000, help="Texts encoded in the bulk test (default: 1000)")
+    parser.add_argument("--queries", type=int, default=200, help="Single-text encodes timed (default: 200)")
+    parser.add_argument("--threads", type=int, default=EMBEDDING_THREADS,
+                        help="Inference threads, 0 = runtime default (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE,
+                        help="Texts per inference call (default: %(default)s)")
+    parser.add_argument("--from-db", action="store_true", help="Use documents from the database instead of synthetic text")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    texts = stored_texts(args.texts) if args.from_db else synthetic_texts(args.texts)
+    queries = [text[:200] for text in synthetic_texts(args.queries, seed=1)]
+
+    results = []
+    for backend in args.backends:
+        try:
+            results.append(benchmark(backend, texts, queries, args.model, args.threads, args.batch_size))
+        except Exception as e:
+            results.append({"backend": backend, "error": str(e)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{len(texts)} texts, {len(queries)} single queries")
+    print(f"{'backend':<22} {'model':<26} {'load s':>8} {'texts/s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['backend']:<22} unavailable: {result['error']}")
+            continue
+        print(f"{result['backend']:<22} {result['model']:<26} {result['load_s']:>8} "
+              f"{result['texts_per_s']:>9} {result['query_p50_ms']:>8} {result['query_p95_ms']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Benchmark VectorStore inserts and queries as the collection grows.
+
+For each corpus size a fresh store is built in a temporary directory from
+synthetic chat messages, embedded with a fast hashing embedder so neither
+Ollama nor an embedding model is needed. Measures batched and single insert
+throughput, query latency percentiles, disk size and memory use, and writes
+the results as JSON so runs on different commits can be compared:
+
+    python benchmark_vector_store.py --sizes 1000 10000 --output before.json
+    python benchmark_vector_store.py --sizes 1000 10000 --compare before.json
+"""
+
+from chromadb.api.types import EmbeddingFunction
+from vector_store import VectorStore
+import argparse
+import contextlib
+import json
+import logging
+import logs
+import numpy
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+import config
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# Zipf-like vocabulary: a few common words and a long tail of rare ones
+VOCABULARY = [f"w{i}" for i in range(5000)] + (
+    "the a to and of is it you that in for this with on what how can do we my error "
+    "python model memory session deploy cache query database file server test"
+).split()
+
+
+class HashingEmbeddingFunction(EmbeddingFunction):
+    """Deterministic bag-of-words embeddings from hashed tokens; fast and dependency-free"""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.model_name = f"synthetic-hash-{dim}"
+
+    def __call__(self, input):
+        vectors = numpy.zeros((len(input), self.dim), dtype=numpy.float32)
+        for row, text in enumerate(input):
+            for token in text.split():
+                vectors[row, zlib.crc32(token.encode()) % self.dim] += 1.0
+        norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+
+class Corpus:
+    """Synthetic chat messages with sessions, roles and creation times spread over a year"""
+
+    def __init__(self, size, seed=0):
+        self.rng = random.Random(seed)
+        self.sessions = max(1, size // 20)
+        weights = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+        self.words = VOCABULARY[::-1]  # The named words get the highest weights
+        self.cumulative = list(numpy.cumsum(weights) / sum(weights))
+        self.start = time.time() - 365 * 86400
+
+    def text(self):
+        length = min(int(self.rng.lognormvariate(3.0, 0.9)) + 3, 400)
+        picks = numpy.searchsorted(self.cumulative, [self.rng.random() for _ in range(length)])
+        return " ".join(self.words[min(i, len(self.words) - 1)] for i in picks)
+
+    def batch(self, count):
+        contents = [self.text() for _ in range(count)]
+        metadatas = [{
+            "session": f"session-{self.rng.randrange(self.sessions)}",
+            "role": self.rng.choice(("user", "assistant")),
+            "created_at": self.start + self.rng.random() * 365 * 86400,
+        } for _ in range(count)]
+        return contents, metadatas
+
+
+def percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(OSError):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def memory_usage():
+    """Current and peak resident set size in MB, where the platform reports them"""
+    usage = {"rss_mb": None, "peak_rss_mb": None}
+    with contextlib.suppress(OSError, ValueError):
+        with open("/proc/self/statm") as f:
+            usage["rss_mb"] = round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in kilobytes on Linux and bytes on macOS
+        usage["peak_rss_mb"] = round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+    except ImportError:
+        pass
+    return usage
+
+
+def benchmark_size(size, args):
+    directory = tempfile.mkdtemp(prefix=f"vector-store-bench-{size}-", dir=args.temp_dir)
+    corpus = Corpus(size, seed=size)
+    result = {"documents": size}
+    try:
+        store = VectorStore(persist_directory=directory, embedding_function=HashingEmbeddingFunction())
+
+        start = time.perf_counter()
+        added = 0
+        while added < size:
+            count = min(args.batch_size, size - added)
+            store.add_texts(*corpus.batch(count))
+            added += count
+            if args.progress and added % (args.batch_size * 100) == 0:
+                print(f"  {size}: {added} documents added", file=sys.stderr)
+        elapsed = time.perf_counter() - start
+        result["batch_insert_docs_per_s"] = round(size / elapsed, 1)
+        result["build_s"] = round(elapsed, 2)
+
+        latencies = []
+        for content, metadata in zip(*corpus.batch(args.single_inserts)):
+            start = time.perf_counter()
+            store.add_text(content, metadata)
+            latencies.append((time.perf_counter() - start) * 1000)
+        result["single_insert"] = percentiles(latencies)
+        result["single_insert_docs_per_s"] = round(1000 * len(latencies) / sum(latencies), 1)
+
+        # Fresh query texts every time, so the query and embedding caches never hit
+        latencies = []
+        for query in corpus.batch(args.queries)[0]:
+            query = " ".join(query.split()[:12])
+            start = time.perf_counter()
+            store.query(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+        result["query"] = percentiles(latencies)
+
+        store.close()
+        result["disk_mb"] = round(directory_size(directory) / 2**20, 2)
+        result.update(memory_usage())
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+def environment():
+    commit = None
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    return {
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {name: getattr(config, name) for name in (
+            "HYBRID_SEARCH", "CHUNK_SIZE", "PRIORITIZE_RECENT", "CONTEXT_WINDOW", "DEBUG_PRINTS"
+        )},
+    }
+
+
+def compare(results, baseline_path):
+    """Print each metric's change relative to a previous results file"""
+    with open(baseline_path) as f:
+        baseline = {run["documents"]: run for run in json.load(f)["results"]}
+    metrics = [
+        ("batch_insert_docs_per_s", None, True),
+        ("single_insert", "p50_ms", False),
+        ("query", "p50_ms", False),
+        ("query", "p95_ms", False),
+        ("query", "p99_ms", False),
+        ("disk_mb", None, False),
+    ]
+    for run in results:
+        base = baseline.get(run["documents"])
+        if base is None:
+            continue
+        print(f"\n{run['documents']} documents vs {baseline_path}")
+        for key, sub, higher_is_better in metrics:
+            new, old = run.get(key), base.get(key)
+            if sub:
+                new, old = (new or {}).get(sub), (old or {}).get(sub)
+            if not new or not old:
+                continue
+            change = (new - old) / old * 100
+            worse = change < 0 if higher_is_better else change > 0
+            flag = "  <- regression" if worse and abs(change) >= 10 else ""
+            print(f"  {key + ('.' + sub if sub else ''):<28} {old:>10} -> {new:>10} ({change:+.1f}%){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VectorStore insert and query performance")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Corpus sizes to build (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per add_texts call (default: 1000)")
+    parser.add_argument("--single-inserts", type=int, default=200, help="add_text calls timed (default: 200)")
+    parser.add_argument("--queries", type=int, default=200, help="Queries timed (default: 200)")
+    parser.add_argument("--temp-dir", default=None, help="Where to build the stores (default: system temp)")
+    parser.add_argument("--keep", action="store_true", help="Keep the built stores instead of deleting them")
+    parser.add_argument("--output", help="Write results as JSON to this file (default: print them)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Show changes against an earlier results file")
+    parser.add_argument("--progress", action="store_true", help="Report build progress on stderr")
+    args = parser.parse_args()
+
+    # The store's debug logging would dominate the timings, so keep only warnings
+    logs.setup_logging()
+    logging.getLogger(logs.ROOT_LOGGER).setLevel(logging.WARNING)
+    results = []
+    for size in args.sizes:
+        print(f"Benchmarking {size} documents...", file=sys.stderr)
+        results.append(benchmark_size(size, args))
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,88 @@
-import ollama
 import uuid
+from collections import deque
 from vector_store import VectorStore
+from context_packer import ContextPacker, estimate_tokens
+from logs import get_logger
+from metrics import PHASE_SECONDS, counter, histogram, span
+from ollama_service import CircuitOpenError, OllamaService, is_transient_error
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import datetime
+import difflib
+import functools
+import itertools
+import threading
 import time
 from config import *
 
+logger = get_logger(__name__)
+
+CHAT_REQUESTS = counter("chat_requests_total", "Chat messages handled, by mode")
+CHAT_ERRORS = counter("chat_errors_total", "Chat messages that ended in an error, by exception type")
+PREFETCH_USED = counter("prefetch_used_total", "Messages answered with history prefetched while typing")
+PREFILL_TOKENS = histogram("prefill_tokens", "Prompt tokens Ollama had to evaluate per request",
+                           buckets=(16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768))
+
+CONTEXT_TEMPLATE = """IMPORTANT: You have access to previous conversations through semantic search. 
+Use this conversation history to maintain context and provide informed responses.
+
+=== Recent Conversation ===
+{recent}
+
+=== Previous Conversations ===
+{history}
+
+=== Current Message ===
+User: {message}
+
+Remember: You MUST use the conversation history above to inform your response. 
+If asked about previous conversations, reference specific details from the history."""
+
+# The newest message in the stable prompt layout; earlier turns are sent as
+# plain messages so the prompt prefix stays the same from one turn to the next
+STABLE_TURN_TEMPLATE = """=== Previous Conversations ===
+{history}
+
+=== Current Message ===
+{message}"""
+
 class ChatInterface:
-    def __init__(self, model_name=DEFAULT_MODEL):
+    def __init__(self, model_name=DEFAULT_MODEL, prompt_layout=PROMPT_LAYOUT, remember=True):
         self.model_name = model_name
+        self.prompt_layout = prompt_layout
+        # With remember off, messages aren't written to the vector store
+        self.remember = remember
         self.vector_store = VectorStore()
+        self.ollama = OllamaService()
+        self.context_packer = ContextPacker()
         self.session_id = str(uuid.uuid4())
+        # Last few turns of this session, so follow-ups don't depend on search
+        self.recent_turns = deque(maxlen=SHORT_TERM_TURNS)
+        # Every turn of this session as sent to the model, for the stable layout
+        self.transcript = []
+        # Prefill measurements of the latest requests, see _record_prompt_stats
+        self.prompt_stats = deque(maxlen=100)
         
         self.system_message = {
             "role": "system",
             "content": SYSTEM_MESSAGE
         }
+        
+        # Speculative retrieval: the latest draft waiting to be searched, and
+        # the last result as (draft, since, candidates)
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_pending = None
+        self._prefetch_thread = None
+        self._prefetched = None
+        self._prefetch_generation = 0
+
+    def warm_up(self):
+        """Load the model now so the first message doesn't wait for it. Returns the seconds taken."""
+        return self.ollama.warm(self.model_name)
+
+    def keep_warm(self):
+        """Keep the model loaded in the background: re-warm it after idle periods and Ollama restarts"""
+        self.ollama.keep_warm(self.model_name)
 
     def _format_response(self, text):
         """Format the response with proper markdown and structure"""
@@ -51,121 +119,518 @@ class ChatInterface:
         # Last resort: word boundary
         return text[:max_length].rsplit(' ', 1)[0] + "...\n\n---\n[Response truncated for length. Ask for more details if needed.]"
 
-    def chat(self, message):
-        try:
-            # Check message length
-            if len(message) > MAX_MESSAGE_LENGTH and DEBUG_PRINTS:
-                print(f"\nWarning: Input message length ({len(message)} chars) exceeds maximum ({MAX_MESSAGE_LENGTH})")
-                print("Message will be truncated for storage")
-            
-            # 1. Get relevant history
-            history = self.vector_store.query(message)
-            if DEBUG_PRINTS:
-                print("\n=== Context Being Sent to Model ===")
-                print(f"Session ID: {self.session_id}")
-                print("Previous conversations:")
-                print(history if history else "No relevant history found")
-                print("=" * 50)
-            
-            # 2. Build messages list with context
-            context_message = """IMPORTANT: You have access to previous conversations through semantic search. 
-Use this conversation history to maintain context and provide informed responses.
+    def _build_messages(self, message):
+        """Retrieve relevant history and build the messages list for the model"""
+        # Check message length
+        if len(message) > MAX_MESSAGE_LENGTH:
+            logger.debug("Input message length (%d chars) exceeds maximum (%d); it will be truncated for storage",
+                         len(message), MAX_MESSAGE_LENGTH)
+        
+        if self.prompt_layout == "stable":
+            return self._build_stable_messages(message)
+        
+        # 1. Take the latest turns from memory, then as much relevant history
+        # as fits in what's left of the context window
+        turns = self._recent_turns_within_budget()
+        recent = self._format_recent(turns)
+        history = self._retrieve_history(
+            message, [CONTEXT_TEMPLATE.format(recent=recent, history="", message=message)], turns
+        )
+        logger.debug("Context for session %s: %d recent turns, %d chars of previous conversations",
+                     self.session_id, len(turns), len(history or ""))
+        
+        # 2. Build messages list with context
+        context_message = CONTEXT_TEMPLATE.format(
+            recent=recent,
+            history=history if history else "No relevant previous conversations found.",
+            message=message
+        )
+        
+        return [
+            self.system_message,
+            {"role": "user", "content": context_message}
+        ]
 
-=== Previous Conversations ===
-{history}
+    def _build_stable_messages(self, message):
+        """System prompt, this session's earlier turns as they were sent, then the new turn.
 
-=== Current Message ===
-User: {message}
+        Everything before the new turn matches what the previous request
+        sent, apart from the previous turn's retrieved memory, so Ollama only
+        has to prefill the last exchange and the new message. Memory is only
+        ever added to the newest message.
+        """
+        messages = [self.system_message]
+        for turn in self.transcript:
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["assistant"]})
+        
+        fixed_texts = [m["content"] for m in messages[1:]]
+        fixed_texts.append(STABLE_TURN_TEMPLATE.format(history="", message=message))
+        history = self._retrieve_history(message, fixed_texts, self.transcript)
+        logger.debug("Context for session %s: %d earlier turns, %d chars of previous conversations",
+                     self.session_id, len(self.transcript), len(history or ""))
+        
+        messages.append({"role": "user", "content": STABLE_TURN_TEMPLATE.format(
+            history=history if history else "No relevant previous conversations found.",
+            message=message
+        )})
+        return messages
 
-Remember: You MUST use the conversation history above to inform your response. 
-If asked about previous conversations, reference specific details from the history.""".format(
-                history=history if history else "No relevant previous conversations found.",
-                message=message
-            )
-            
-            messages = [
-                self.system_message,
-                {"role": "user", "content": context_message}
-            ]
-            
-            # 3. Get model response with retry logic
-            max_retries = 3
-            retry_delay = 2  # seconds
-            
-            for attempt in range(max_retries):
-                try:
-                    if DEBUG_PRINTS and attempt > 0:
-                        print(f"\nRetry attempt {attempt + 1}/{max_retries}")
-                    
-                    response = ollama.chat(
-                        model=self.model_name,
-                        messages=messages,
-                        stream=False,
-                        options={
-                            "num_ctx": OLLAMA_NUM_CTX,
-                            "num_predict": OLLAMA_NUM_PREDICT,
-                        }
-                    )
-                    
-                    # If we get here, the call succeeded
-                    break
-                    
-                except Exception as e:
-                    if "overloaded" in str(e).lower():
-                        if attempt < max_retries - 1:
-                            if DEBUG_PRINTS:
-                                print(f"API overloaded, waiting {retry_delay} seconds before retry...")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                            continue
-                    # If it's not an overload error or we're out of retries, raise it
-                    raise
-            
-            # Get and format response
-            ai_response = response['message']['content']
+    def _trim_transcript(self):
+        """Drop the oldest turns once the transcript is over TRANSCRIPT_MAX_TOKENS.
+
+        Removing turns changes the prompt prefix and forces a full prefill,
+        so it's done in one large step down to half the limit rather than a
+        turn at a time.
+        """
+        costs = [estimate_tokens(t["user"]) + estimate_tokens(t["assistant"]) for t in self.transcript]
+        total = sum(costs)
+        if total <= TRANSCRIPT_MAX_TOKENS:
+            return
+        dropped = 0
+        while dropped < len(costs) and total > TRANSCRIPT_MAX_TOKENS // 2:
+            total -= costs[dropped]
+            dropped += 1
+        del self.transcript[:dropped]
+
+    def _recent_turns_within_budget(self):
+        """Newest turns from the ring buffer, dropping the oldest past SHORT_TERM_MAX_TOKENS"""
+        turns = []
+        used = 0
+        for turn in reversed(self.recent_turns):
+            cost = estimate_tokens(turn["user"]) + estimate_tokens(turn["assistant"])
+            if turns and used + cost > SHORT_TERM_MAX_TOKENS:
+                break
+            turns.append(turn)
+            used += cost
+        return turns[::-1]
+
+    @staticmethod
+    def _format_recent(turns):
+        if not turns:
+            return "No earlier messages in this session."
+        lines = []
+        for turn in turns:
+            lines.append(f"User: {turn['user']}")
+            lines.append(f"Assistant: {turn['assistant']}")
+        return "\n".join(lines)
+
+    def _retrieve_history(self, message, fixed_texts=(), turns=()):
+        """Over-fetch similar messages and keep the best ones that fit the token budget.
+
+        fixed_texts are the other parts of the prompt, which the budget
+        leaves room for. Anything already in turns is left out.
+        """
+        with span("retrieval"):
+            return self._select_history(message, fixed_texts, turns)
+
+    def _select_history(self, message, fixed_texts, turns):
+        since = self._history_since()
+        candidates = self._take_prefetched(message, since)
+        if candidates is None:
+            try:
+                candidates = self.vector_store.search(message, n_results=CONTEXT_CANDIDATES, since=since)
+            except Exception as e:
+                logger.error("Error querying vector store: %s", e)
+                return None
+        
+        seen_ids = {turn[key] for turn in turns for key in ("user_id", "assistant_id")}
+        seen_texts = {turn[key] for turn in turns for key in ("user", "assistant")}
+        candidates = [
+            record for record in candidates
+            if record['id'] not in seen_ids and record['document'] not in seen_texts
+        ]
+        
+        budget = self.context_packer.budget([self.system_message["content"], *fixed_texts])
+        selected = self.context_packer.pack(candidates, budget)
+        if not selected:
+            return None
+        return self.vector_store.format_history(selected)
+
+    @staticmethod
+    def _history_since():
+        if MAX_HISTORY_AGE_DAYS is None:
+            return None
+        # Rounded to the hour so repeated queries can share cached results
+        return (time.time() // 3600) * 3600 - MAX_HISTORY_AGE_DAYS * 86400
+
+    def prefetch(self, draft):
+        """Start searching history for a message that is still being typed.
+
+        Runs on a background thread. Only the newest draft is searched: one
+        still waiting when another arrives is dropped. The result is used by
+        the next message sent if that message is close enough to the draft.
+        """
+        draft = draft.strip()
+        if len(draft) < PREFETCH_MIN_CHARS:
+            return
+        with self._prefetch_lock:
+            if self._prefetched is not None and self._prefetched[0] == draft:
+                return
+            self._prefetch_pending = draft
+            if self._prefetch_thread is None:
+                self._prefetch_thread = threading.Thread(target=self._run_prefetch, name="prefetch", daemon=True)
+                self._prefetch_thread.start()
+
+    def _run_prefetch(self):
+        while True:
+            with self._prefetch_lock:
+                draft, self._prefetch_pending = self._prefetch_pending, None
+                if draft is None:
+                    self._prefetch_thread = None
+                    return
+                generation = self._prefetch_generation
+            
+            since = self._history_since()
+            try:
+                candidates = self.vector_store.search(draft, n_results=CONTEXT_CANDIDATES, since=since)
+            except Exception as e:
+                logger.warning("Error prefetching history: %s", e)
+                continue
+            
+            with self._prefetch_lock:
+                # A message sent during the search makes this result stale
+                if generation == self._prefetch_generation:
+                    self._prefetched = (draft, since, candidates)
+
+    def _take_prefetched(self, message, since):
+        """Return prefetched candidates if they were searched for a draft close to message"""
+        with self._prefetch_lock:
+            prefetched, self._prefetched = self._prefetched, None
+            self._prefetch_pending = None
+            self._prefetch_generation += 1
+        if prefetched is None:
+            return None
+        
+        draft, draft_since, candidates = prefetched
+        message = message.strip()
+        if draft_since != since:
+            return None
+        if draft != message:
+            matcher = difflib.SequenceMatcher(None, draft, message, autojunk=False)
+            if (matcher.real_quick_ratio() < PREFETCH_MIN_SIMILARITY
+                    or matcher.quick_ratio() < PREFETCH_MIN_SIMILARITY
+                    or matcher.ratio() < PREFETCH_MIN_SIMILARITY):
+                return None
+        PREFETCH_USED.inc()
+        logger.debug("Using history prefetched while typing (%d candidates)", len(candidates))
+        return candidates
+
+    def _call_model(self, messages, stream=False):
+        """Call the model with retry logic.
+
+        With stream=True the retries cover everything up to the first chunk,
+        and an iterator over all chunks is returned.
+        """
+        max_retries = 3
+        retry_delay = 2  # seconds
+        
+        for attempt in range(max_retries):
+            try:
+                if attempt > 0:
+                    logger.info("Retry attempt %d/%d", attempt + 1, max_retries)
+                
+                response = self.ollama.chat(
+                    model=self.model_name,
+                    messages=messages,
+                    stream=stream,
+                    options={
+                        "num_ctx": OLLAMA_NUM_CTX,
+                        "num_predict": OLLAMA_NUM_PREDICT,
+                    }
+                )
+                
+                if stream:
+                    # Errors only surface once the stream is read, so pull the
+                    # first chunk while we can still retry
+                    first_chunk = next(response, None)
+                    if first_chunk is None:
+                        return iter(())
+                    return itertools.chain([first_chunk], response)
+                
+                # If we get here, the call succeeded
+                return response
+                
+            except Exception as e:
+                if is_transient_error(e):
+                    if attempt < max_retries - 1:
+                        logger.warning("Ollama request failed (%s), waiting %d seconds before retry...", e, retry_delay)
+                        time.sleep(retry_delay)
+                        retry_delay *= 2  # Exponential backoff
+                        continue
+                # If it's not a transient error or we're out of retries, raise it
+                raise
+
+    def _record_prompt_stats(self, response, messages):
+        """Keep the prefill figures Ollama reports with the final part of a response.
+
+        prompt_eval_count only counts tokens that had to be evaluated, so it
+        drops when Ollama reuses its cached prefix for the prompt.
+        """
+        if not response.get('done'):
+            return
+        stats = {
+            "prompt_tokens": sum(estimate_tokens(m["content"]) for m in messages),
+            "prompt_eval_count": response.get('prompt_eval_count', 0),
+            "prompt_eval_ms": response.get('prompt_eval_duration', 0) / 1e6,
+        }
+        self.prompt_stats.append(stats)
+        PREFILL_TOKENS.observe(stats['prompt_eval_count'])
+        logger.debug("Prefill: %d tokens evaluated in %.0f ms (prompt ~%d tokens)",
+                     stats['prompt_eval_count'], stats['prompt_eval_ms'], stats['prompt_tokens'])
+
+    def _finish_response(self, message, ai_response):
+        """Format and truncate the model response, then store both messages"""
+        raw_response = ai_response
+        with span("formatting"):
             ai_response = self._format_response(ai_response)
             if TRUNCATE_RESPONSE:
                 ai_response = self._truncate_text(ai_response)
+        
+        # 4. Store messages in the background so the reply isn't held up
+        timestamp = str(datetime.datetime.now())
+        
+        user_metadata = {
+            "session": self.session_id,
+            "timestamp": timestamp,
+            "role": "user"
+        }
+        ai_metadata = {
+            "session": self.session_id,
+            "timestamp": timestamp,
+            "role": "assistant"
+        }
+        msg_id = resp_id = None
+        if self.remember:
+            with span("storage"):
+                msg_id, resp_id = self.vector_store.add_texts_deferred(
+                    [message, ai_response],
+                    [user_metadata, ai_metadata]
+                )
+        
+        self.recent_turns.append({
+            "user": message,
+            "user_id": msg_id,
+            "assistant": ai_response,
+            "assistant_id": resp_id,
+        })
+        # The model's own unformatted text, so the next prompt repeats exactly
+        # what it generated and its cached prefix still applies
+        self.transcript.append({
+            "user": message,
+            "user_id": msg_id,
+            "assistant": raw_response,
+            "assistant_id": resp_id,
+        })
+        self._trim_transcript()
+        
+        logger.debug("Messages queued for storage: user %s, assistant %s", msg_id, resp_id)
+        
+        return ai_response
+
+    def _storage_note(self):
+        """A note for the user when earlier messages could not be stored, otherwise empty"""
+        dropped = self.vector_store.dropped_writes()
+        if not dropped:
+            return ""
+        return f"\n\n(Note: {dropped} earlier message entries could not be saved to the chat history.)"
+
+    def _error_response(self, error):
+        """Turn an exception raised while chatting into a message for the user"""
+        error_msg = str(error)
+        CHAT_ERRORS.inc(error=type(error).__name__)
+        logger.error("Error in chat: %s", error_msg)
+        
+        if isinstance(error, CircuitOpenError):
+            return "I apologize, but the model server is currently unavailable. Please try again in a moment."
+        elif "overloaded" in error_msg.lower():
+            return "I apologize, but the system is currently experiencing high load. Please try again in a moment."
+        elif "context length" in error_msg.lower():
+            return "I apologize, but the conversation context is too long. Let's start a new topic or rephrase your question."
+        else:
+            return f"I encountered an error while processing your request: {error_msg}"
+
+    def chat(self, message):
+        CHAT_REQUESTS.inc(mode="chat")
+        with self.ollama.in_use():
+            try:
+                with span("prompt_build"):
+                    messages = self._build_messages(message)
+            
+                # 3. Get model response with retry logic
+                with span("generation"):
+                    response = self._call_model(messages)
+                self._record_prompt_stats(response, messages)
+            
+                # Get, format and store response
+                return self._finish_response(message, response['message']['content']) + self._storage_note()
             
-            # 4. Store messages
-            timestamp = str(datetime.datetime.now())
-            
-            # Store user message
-            user_metadata = {
-                "session": self.session_id,
-                "timestamp": timestamp,
-                "role": "user"
-            }
-            msg_id = self.vector_store.add_text(message, user_metadata)
-            
-            # Store AI response
-            ai_metadata = {
-                "session": self.session_id,
-                "timestamp": timestamp,
-                "role": "assistant"
-            }
-            resp_id = self.vector_store.add_text(ai_response, ai_metadata)
-            
-            if DEBUG_PRINTS:
-                print("\n=== Messages Stored Successfully ===")
-                print(f"User message ID: {msg_id}")
-                print(f"AI response ID: {resp_id}")
-                print("=" * 50)
-            
-            return ai_response
-            
-        except Exception as e:
-            error_msg = str(e)
-            if DEBUG_PRINTS:
-                print(f"\nError in chat: {error_msg}")
-            
-            if "overloaded" in error_msg.lower():
-                return "I apologize, but the system is currently experiencing high load. Please try again in a moment."
-            elif "context length" in error_msg.lower():
-                return "I apologize, but the conversation context is too long. Let's start a new topic or rephrase your question."
-            else:
-                return f"I encountered an error while processing your request: {error_msg}"
+            except Exception as e:
+                return self._error_response(e)
+
+    def chat_stream(self, message):
+        """Like chat(), but yields the response in chunks as the model produces them.
+
+        Formatting, truncation and storage run once the stream has finished, so
+        the stored response may differ slightly from the streamed text.
+        """
+        CHAT_REQUESTS.inc(mode="stream")
+        with self.ollama.in_use():
+            start = time.perf_counter()
+            chunks = []
+            try:
+                with span("prompt_build"):
+                    messages = self._build_messages(message)
+            
+                # Includes the time the caller spends handling each chunk
+                with span("generation"):
+                    for part in self._call_model(messages, stream=True):
+                        chunk = part['message']['content']
+                        if chunk:
+                            if not chunks:
+                                PHASE_SECONDS.observe(time.perf_counter() - start, phase="time_to_first_token")
+                            chunks.append(chunk)
+                            yield chunk
+                        self._record_prompt_stats(part, messages)
+            
+                self._finish_response(message, "".join(chunks))
+                note = self._storage_note()
+                if note:
+                    yield note
+            
+            except Exception as e:
+                if chunks:
+                    yield "\n\n"
+                yield self._error_response(e)
 
     def new_session(self):
         """Start a new chat session with a new session ID."""
         self.session_id = str(uuid.uuid4())
+        self.recent_turns.clear()
+        self.transcript.clear()
+
+
+class AsyncChatInterface(ChatInterface):
+    """ChatInterface for asyncio code, built on the async Ollama client.
+
+    Blocking vector store work runs on a bounded thread pool shared by all
+    instances, so a single event loop can drive many conversations at once.
+    """
+    
+    _executor = None
+    _executor_lock = threading.Lock()
+    
+    def __init__(self, model_name=DEFAULT_MODEL, client=None, prompt_layout=PROMPT_LAYOUT, remember=True):
+        super().__init__(model_name, prompt_layout, remember)
+        self.client = client or self.ollama.async_client()
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=ASYNC_STORE_WORKERS,
+                    thread_name_prefix="vector-store"
+                )
+            return cls._executor
+
+    async def _run_blocking(self, func, *args):
+        """Run a blocking call on the shared executor without stalling the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args))
+
+    async def _call_model(self, messages, stream=False):
+        """Call the model with retry logic, backing off without blocking the loop"""
+        max_retries = 3
+        retry_delay = 2  # seconds
+        
+        for attempt in range(max_retries):
+            try:
+                if attempt > 0:
+                    logger.info("Retry attempt %d/%d", attempt + 1, max_retries)
+                
+                self.ollama.breaker.check()
+                response = await self.client.chat(
+                    model=self.model_name,
+                    messages=messages,
+                    stream=stream,
+                    options={
+                        "num_ctx": OLLAMA_NUM_CTX,
+                        "num_predict": OLLAMA_NUM_PREDICT,
+                    },
+                    keep_alive=OLLAMA_KEEP_ALIVE
+                )
+                self.ollama.mark_used(self.model_name)
+                
+                if stream:
+                    # Pull the first chunk while we can still retry
+                    try:
+                        first_chunk = await response.__anext__()
+                    except StopAsyncIteration:
+                        return self._chain_chunks(None, response)
+                    self.ollama.breaker.record_success()
+                    return self._chain_chunks(first_chunk, response)
+                
+                self.ollama.breaker.record_success()
+                return response
+                
+            except Exception as e:
+                if is_transient_error(e):
+                    self.ollama.breaker.record_failure()
+                    if attempt < max_retries - 1:
+                        logger.warning("Ollama request failed (%s), waiting %d seconds before retry...", e, retry_delay)
+                        await asyncio.sleep(retry_delay)
+                        retry_delay *= 2  # Exponential backoff
+                        continue
+                raise
+
+    @staticmethod
+    async def _chain_chunks(first_chunk, rest):
+        if first_chunk is not None:
+            yield first_chunk
+            async for chunk in rest:
+                yield chunk
+
+    async def chat(self, message):
+        CHAT_REQUESTS.inc(mode="chat")
+        with self.ollama.in_use():
+            try:
+                with span("prompt_build"):
+                    messages = await self._run_blocking(self._build_messages, message)
+                with span("generation"):
+                    response = await self._call_model(messages)
+                self._record_prompt_stats(response, messages)
+                return self._finish_response(message, response['message']['content']) + self._storage_note()
+            
+            except Exception as e:
+                return self._error_response(e)
+
+    async def chat_stream(self, message):
+        """Async generator yielding the response in chunks, like ChatInterface.chat_stream"""
+        CHAT_REQUESTS.inc(mode="stream")
+        with self.ollama.in_use():
+            start = time.perf_counter()
+            chunks = []
+            try:
+                with span("prompt_build"):
+                    messages = await self._run_blocking(self._build_messages, message)
+            
+                with span("generation"):
+                    async for part in await self._call_model(messages, stream=True):
+                        chunk = part['message']['content']
+                        if chunk:
+                            if not chunks:
+                                PHASE_SECONDS.observe(time.perf_counter() - start, phase="time_to_first_token")
+                            chunks.append(chunk)
+                            yield chunk
+                        self._record_prompt_stats(part, messages)
+            
+                self._finish_response(message, "".join(chunks))
+                note = self._storage_note()
+                if note:
+                    yield note
+            
+            except Exception as e:
+                if chunks:
+                    yield "\n\n"
+                yield self._error_response(e)
@@ -1,38 +1,113 @@
+"""Script to print the contents of the vector database"""
+
 from vector_store import VectorStore
+import argparse
+import contextlib
+import csv
+import json
 import sys
-from config import DEBUG_PRINTS
+from config import SCAN_BATCH_SIZE
 
 # Set console to UTF-8 mode
 if sys.platform.startswith('win'):
     import codecs
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'replace')
 
-def check_database():
+def build_filter(session=None, role=None):
+    """Build a Chroma where filter from the optional session and role"""
+    conditions = []
+    if session:
+        conditions.append({"session": session})
+    if role:
+        conditions.append({"role": role})
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+def print_text(records):
+    count = 0
+    for record in records:
+        meta = record['metadata']
+        print(f"\nSession: {meta.get('session', 'N/A')}")
+        print(f"Role: {meta.get('role', 'N/A')}")
+        print(f"Timestamp: {meta.get('timestamp', 'N/A')}")
+        try:
+            print(f"Content: {record['document']}")
+        except UnicodeEncodeError:
+            print(f"Content: {record['document'].encode('utf-8', 'replace').decode()}")
+        print("-" * 50)
+        count += 1
+    return count
+
+def print_jsonl(records):
+    count = 0
+    for record in records:
+        print(json.dumps(record, ensure_ascii=False))
+        count += 1
+    return count
+
+def print_csv(records):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["id", "session", "role", "timestamp", "content"])
+    count = 0
+    for record in records:
+        meta = record['metadata']
+        writer.writerow([
+            record['id'],
+            meta.get('session', ''),
+            meta.get('role', ''),
+            meta.get('timestamp', ''),
+            record['document'],
+        ])
+        count += 1
+    return count
+
+FORMATTERS = {
+    "text": print_text,
+    "jsonl": print_jsonl,
+    "csv": print_csv,
+}
+
+def check_database(session=None, role=None, output_format="text", batch_size=SCAN_BATCH_SIZE):
+    """Stream the stored documents to stdout, one page at a time"""
     try:
-        # Get the VectorStore instance
-        store = VectorStore()
-        
-        # Get all documents directly from the collection
-        result = store.collection.get()
+        # Get the VectorStore instance, keeping its debug output out of
+        # machine-readable formats
+        if output_format == "text":
+            store = VectorStore()
+        else:
+            with contextlib.redirect_stdout(sys.stderr):
+                store = VectorStore()
         
-        print(f"\nFound {len(result['documents'])} documents in the database:")
-        print("-" * 50)
+        where = build_filter(session, role)
+        if output_format == "text":
+            if where is None:
+                print(f"\nFound {store.collection.count()} documents in the database:")
+            print("-" * 50)
         
-        # Sort by timestamp if available
-        sorted_items = list(zip(result['documents'], result['metadatas']))
-        sorted_items.sort(key=lambda x: x[1].get('timestamp', ''))
+        # Records are streamed in ID order, so memory use doesn't grow with the collection
+        records = store.iter_records(where=where, batch_size=batch_size)
+        count = FORMATTERS[output_format](records)
         
-        for doc, meta in sorted_items:
-            print(f"\nSession: {meta.get('session', 'N/A')}")
-            print(f"Timestamp: {meta.get('timestamp', 'N/A')}")
-            try:
-                print(f"Content: {doc}")
-            except UnicodeEncodeError:
-                print(f"Content: {doc.encode('utf-8', 'replace').decode()}")
-            print("-" * 50)
+        if output_format == "text" and where is not None:
+            print(f"\nFound {count} matching documents")
             
     except Exception as e:
-        print(f"Error checking database: {e}")
+        print(f"Error checking database: {e}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the contents of the chat history database")
+    parser.add_argument("--session", help="Only show messages from this session ID")
+    parser.add_argument("--role", choices=["user", "assistant"], help="Only show messages with this role")
+    parser.add_argument("--format", dest="output_format", choices=sorted(FORMATTERS), default="text",
+                        help="Output format (default: text)")
+    parser.add_argument("--batch-size", type=int, default=SCAN_BATCH_SIZE,
+                        help=f"Documents fetched per page (default: {SCAN_BATCH_SIZE})")
+    args = parser.parse_args()
+    
+    check_database(args.session, args.role, args.output_format, args.batch_size)
 
 if __name__ == "__main__":
-    check_database()
+    main()
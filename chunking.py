@@ -0,0 +1,92 @@
+import re
+from config import *
+
+# Boundaries to split on, from most to least preferred: markdown headers,
+# paragraphs, sentences, then any whitespace
+SEPARATORS = [r"\n(?=#)", r"\n\s*\n", r"(?<=[.!?])\s+", r"\s+"]
+
+
+def split_text(text, max_size=CHUNK_SIZE, min_size=MIN_CHUNK_SIZE):
+    """Split text into chunks of at most about max_size characters.
+
+    Splits happen at the most structural boundary available, and chunks
+    are consecutive slices of text, so "".join(chunks) == text. A chunk shorter
+    than min_size is merged into its neighbour, which can push that neighbour
+    slightly past max_size.
+    """
+    if len(text) <= max_size:
+        return [text]
+
+    chunks = []
+    for piece in _split_pieces(text, max_size, 0):
+        if chunks and len(chunks[-1]) + len(piece) <= max_size:
+            chunks[-1] += piece
+        else:
+            chunks.append(piece)
+
+    merged = []
+    for chunk in chunks:
+        if merged and (len(chunk) < min_size or len(merged[-1]) < min_size):
+            merged[-1] += chunk
+        else:
+            merged.append(chunk)
+    return merged
+
+
+def _split_pieces(text, max_size, level):
+    if len(text) <= max_size:
+        return [text]
+    if level == len(SEPARATORS):
+        return [text[i:i + max_size] for i in range(0, len(text), max_size)]
+
+    boundaries = [0] + [m.end() for m in re.finditer(SEPARATORS[level], text)] + [len(text)]
+    pieces = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        if end > start:
+            pieces.extend(_split_pieces(text[start:end], max_size, level + 1))
+    return pieces
+
+
+CHUNK_FIELDS = ("parent_id", "chunk_index", "chunk_count")
+
+
+def chunk_id(parent_id, index):
+    """ID under which chunk index of a message is stored"""
+    return f"{parent_id}#{index}"
+
+
+def merge_chunks(records):
+    """Join chunk records back into one record per message.
+
+    Records without chunk metadata pass through unchanged. Chunks are grouped
+    by parent in order of first appearance and joined in chunk order; the
+    merged record takes the parent ID, the first chunk's metadata and the
+    smallest distance, if the records have one.
+    """
+    merged = {}
+    for record in records:
+        meta = record['metadata']
+        parent_id = meta.get('parent_id')
+        if parent_id is None:
+            merged[record['id']] = record
+            continue
+        merged.setdefault(parent_id, []).append(record)
+
+    results = []
+    for key, value in merged.items():
+        if isinstance(value, dict):
+            results.append(value)
+            continue
+        chunks = sorted(value, key=lambda r: r['metadata'].get('chunk_index', 0))
+        metadata = {k: v for k, v in chunks[0]['metadata'].items() if k not in CHUNK_FIELDS}
+        metadata['tokens'] = sum(c['metadata'].get('tokens', 0) for c in chunks)
+        record = {
+            "id": key,
+            "document": "".join(c['document'] for c in chunks),
+            "metadata": metadata,
+        }
+        distances = [c['distance'] for c in chunks if 'distance' in c]
+        if distances:
+            record['distance'] = min(distances)
+        results.append(record)
+    return results
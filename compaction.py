@@ -0,0 +1,194 @@
+"""Summarizes old chat sessions and replaces their raw turns with the summaries.
+
+Raw turns are moved, embeddings included, into the archive collection, and
+each summary records the session it came from, so the originals stay
+reachable through VectorStore.get_archived(). Without this the collection
+(and with it the HNSW index and query latency) grows with every turn forever.
+
+Run once from the command line with:
+    python compaction.py [--max-age-days N] [--dry-run]
+"""
+
+from vector_store import VectorStore
+from ollama_service import OllamaService
+from chunking import merge_chunks
+from context_packer import estimate_tokens
+from logs import get_logger
+import argparse
+import threading
+import time
+from config import *
+
+logger = get_logger(__name__)
+
+SUMMARY_PROMPT = """Summarize the following part of a conversation between a user and an AI assistant.
+Keep the facts, names, decisions, code identifiers and open questions that would help
+continue the conversation later. Write plain prose or short bullet points, no preamble.
+
+{transcript}"""
+
+
+class SessionCompactor:
+    """Finds sessions older than a cut-off and replaces them with model-written summaries"""
+
+    def __init__(self, store=None, model_name=COMPACTION_MODEL, max_age_days=COMPACTION_AGE_DAYS,
+                 idle_seconds=COMPACTION_IDLE_SECONDS):
+        self.store = store or VectorStore()
+        self.ollama = OllamaService()
+        self.model_name = model_name
+        self.max_age_days = max_age_days
+        # Each summary request waits until no chat has been in progress for
+        # this long, so summaries don't queue ahead of a reply in Ollama
+        self.idle_seconds = idle_seconds
+
+    def find_sessions(self):
+        """IDs of sessions with no activity since the cut-off that still hold raw turns"""
+        cutoff = time.time() - self.max_age_days * 86400
+        old, recent = set(), set()
+        # Not filtered on created_at in Chroma: entries from before it was
+        # stored only have an ISO timestamp, which created_at() falls back to
+        for record in self.store.iter_records(include=("metadatas",)):
+            meta = record['metadata']
+            created = VectorStore.created_at(meta)
+            if created is not None and created >= cutoff:
+                recent.add(meta.get('session'))
+            elif meta.get('session') and meta.get('role') != 'summary':
+                old.add(meta['session'])
+        return sorted(old - recent)
+
+    def compact_session(self, session_id):
+        """Summarize one session, archive its raw entries and replace them. Returns the summary count."""
+        raw = list(self.store.iter_records(
+            where={"session": session_id},
+            include=("documents", "metadatas", "embeddings")
+        ))
+        raw = [record for record in raw if record['metadata'].get('role') != 'summary']
+        if not raw:
+            return 0
+
+        messages = merge_chunks([
+            {"id": r['id'], "document": r['document'], "metadata": dict(r['metadata'])} for r in raw
+        ])
+        messages.sort(key=lambda r: (VectorStore.created_at(r['metadata']) or 0, r['metadata'].get('role') != 'user'))
+
+        summaries = [self._summarize(part) for part in self._split_transcript(messages)]
+        last_created = max(VectorStore.created_at(r['metadata']) or 0 for r in messages) or time.time()
+        metadata = {
+            "session": session_id,
+            "role": "summary",
+            "created_at": last_created,
+            "archived_session": session_id,
+            "archived_count": len(raw),
+        }
+
+        # Archive first and delete last, so a failure part way leaves duplicates
+        # rather than losing anything
+        self.store.archive_records(raw)
+        self.store.add_texts(summaries, [dict(metadata) for _ in summaries])
+        self.store.delete([record['id'] for record in raw])
+
+        logger.info("Compacted session %s: %d messages -> %d summaries", session_id, len(messages), len(summaries))
+        return len(summaries)
+
+    def run_once(self, max_sessions=None, stop=None):
+        """Compact eligible sessions, at most max_sessions of them and until stop is set.
+
+        Returns the number of sessions compacted.
+        """
+        self.store.flush()
+        compacted = 0
+        for session_id in self.find_sessions()[:max_sessions]:
+            if stop is not None and stop.is_set():
+                break
+            try:
+                if self.compact_session(session_id):
+                    compacted += 1
+            except Exception as e:
+                logger.error("Error compacting session %s: %s", session_id, e)
+        return compacted
+
+    @staticmethod
+    def _split_transcript(messages):
+        """Group messages into transcript parts of about COMPACTION_PART_TOKENS each"""
+        parts, current, used = [], [], 0
+        for message in messages:
+            line = f"{message['metadata'].get('role', 'unknown').capitalize()}: {message['document']}"
+            cost = estimate_tokens(line)
+            if current and used + cost > COMPACTION_PART_TOKENS:
+                parts.append("\n\n".join(current))
+                current, used = [], 0
+            current.append(line)
+            used += cost
+        if current:
+            parts.append("\n\n".join(current))
+        return parts
+
+    def _summarize(self, transcript):
+        self.ollama.wait_idle(self.idle_seconds)
+        response = self.ollama.chat(
+            model=self.model_name,
+            messages=[{"role": "user", "content": SUMMARY_PROMPT.format(transcript=transcript)}],
+            stream=False,
+            options={"num_ctx": OLLAMA_NUM_CTX}
+        )
+        return response['message']['content'].strip()
+
+
+class CompactionJob:
+    """Runs SessionCompactor.run_once in a background thread every interval seconds.
+
+    The first run waits start_delay seconds and each run compacts at most
+    max_sessions sessions, so a large backlog is worked off gradually
+    instead of occupying the model right after startup.
+    """
+
+    def __init__(self, compactor=None, interval=COMPACTION_INTERVAL, start_delay=COMPACTION_START_DELAY,
+                 max_sessions=COMPACTION_MAX_SESSIONS):
+        self.compactor = compactor or SessionCompactor()
+        self.interval = interval
+        self.start_delay = start_delay
+        self.max_sessions = max_sessions
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="compaction", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        delay = self.start_delay
+        while not self._stop.wait(delay):
+            try:
+                self.compactor.run_once(self.max_sessions, self._stop)
+            except Exception as e:
+                logger.error("Error during compaction: %s", e)
+            delay = self.interval
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize and archive old chat sessions")
+    parser.add_argument("--max-age-days", type=float, default=COMPACTION_AGE_DAYS,
+                        help=f"Compact sessions inactive for this many days (default: {COMPACTION_AGE_DAYS})")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the sessions that would be compacted")
+    args = parser.parse_args()
+
+    compactor = SessionCompactor(max_age_days=args.max_age_days)
+    if args.dry_run:
+        sessions = compactor.find_sessions()
+        print(f"{len(sessions)} sessions would be compacted")
+        for session_id in sessions:
+            print(session_id)
+        return
+    print(f"Compacted {compactor.run_once()} sessions")
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,100 @@ CONTEXT_WINDOW = 2  # Reduced number of previous messages to include
 OLLAMA_CONTEXT_LENGTH = 16384  # Increased maximum context length
 OLLAMA_NUM_CTX = 16384        # Increased context window size
 OLLAMA_NUM_PREDICT = 4096     # Increased maximum tokens to predict
+STREAM_RESPONSES = True       # Show responses in the GUI as they are generated
+ASYNC_STORE_WORKERS = 4       # Threads for vector store calls made by AsyncChatInterface
+OLLAMA_REQUEST_TIMEOUT = 300  # Seconds to wait for data from Ollama during a request
+OLLAMA_CONNECT_TIMEOUT = 5    # Seconds to wait when connecting to Ollama
+OLLAMA_POOL_SIZE = 10         # Keep-alive connections held open to Ollama
+OLLAMA_HEARTBEAT_INTERVAL = 5  # Seconds between background health checks
+OLLAMA_HEARTBEAT_TIMEOUT = 5  # Seconds before a health check counts as failed
+OLLAMA_STARTUP_TIMEOUT = 10   # Seconds to wait for a freshly started server
+OLLAMA_BREAKER_FAILURES = 3   # Consecutive failures that open the circuit breaker
+OLLAMA_BREAKER_RESET_TIMEOUT = 15  # Seconds before a trial request is let through
+OLLAMA_KEEP_ALIVE = 1800      # Seconds Ollama keeps the model loaded after a request (-1 = forever)
+MODEL_WARMUP = True           # Load the model with a tiny request at startup
+MODEL_REWARM_INTERVAL = 1500  # Re-warm the model after this many idle seconds (None = only after restarts)
 
 # Context management
 MAX_MESSAGE_LENGTH = 4000      # Increased maximum message length
 TRUNCATE_RESPONSE = True       # Whether to truncate long responses
 PRIORITIZE_RECENT = True       # Prioritize recent context over older ones
+RECENCY_WEIGHT = 0.3           # Share of a result's score that comes from recency
+RECENCY_HALF_LIFE_DAYS = 30    # Age at which the recency part of the score halves
+RECENCY_OVERFETCH = 3          # Extra candidates fetched so recent entries can rank up
+MAX_HISTORY_AGE_DAYS = None    # Ignore history older than this many days (None = no limit)
 MIN_CHUNK_SIZE = 100          # Minimum size of text chunk to store
+CHUNK_SIZE = 800              # Messages longer than this are stored as several chunks
+CHUNK_OVERFETCH = 2           # Extra chunk hits fetched per requested message
+CONTEXT_CANDIDATES = 20       # Similar messages fetched before packing the prompt
+MAX_HISTORY_TOKENS = 8192     # Upper limit on tokens of retrieved history per prompt
+SHORT_TERM_TURNS = 4          # Recent turns of the session always included in the prompt
+SHORT_TERM_MAX_TOKENS = 3000  # Upper limit on tokens of recent turns per prompt
+PROMPT_LAYOUT = "stable"      # "stable": session turns as separate messages, memory only in the newest
+                              # (lets Ollama reuse its cached prefill); "template": one combined message
+TRANSCRIPT_MAX_TOKENS = 6000  # Earlier turns sent verbatim in the stable layout; the oldest half is
+                              # dropped when exceeded, so the cached prefix rarely changes
+SPECULATIVE_RETRIEVAL = True  # Search history for the draft while the user is typing
+PREFETCH_DEBOUNCE_MS = 300    # Typing pause before the draft is searched
+PREFETCH_MIN_CHARS = 8        # Shorter drafts aren't searched
+PREFETCH_MIN_SIMILARITY = 0.9  # How close the sent message must be to the searched draft
+CONTEXT_SAFETY_MARGIN = 512   # Tokens left unused to absorb estimation error
+CHARS_PER_TOKEN = 4           # Characters per token used for estimates
 
 # Database settings
 DB_DIRECTORY = "chroma_db"     # Directory for ChromaDB storage
 COLLECTION_NAME = "chat_history"  # Name of the collection in ChromaDB
+SHARD_BY = None                # "month" or "year": one collection per period, by created_at (None = one
+                               # collection). An existing unsharded collection stays readable alongside
+SHARD_QUERY_WORKERS = 4        # Threads searching shards in parallel
+ARCHIVE_COLLECTION_NAME = "chat_history_archive"  # Raw turns replaced by summaries
+CHANGE_LOG_FILE = "change_log.sqlite3"  # Index of write times, kept in DB_DIRECTORY
+LEXICAL_INDEX_FILE = "lexical_index.sqlite3"  # BM25 index, kept in DB_DIRECTORY
 SIMILARITY_THRESHOLD = 1.5     # Threshold for semantic similarity
+HYBRID_SEARCH = True           # Merge BM25 keyword matches into semantic search results
+BM25_K1 = 1.2                  # BM25 term frequency saturation
+BM25_B = 0.75                  # BM25 document length normalization
+BM25_MAX_POSTINGS = 1000       # Best-matching documents read per query term, so search time stays flat
+RRF_K = 60                     # Reciprocal-rank fusion constant
+EMBEDDING_CACHE_SIZE = 512     # Number of text embeddings kept in memory
+QUERY_CACHE_SIZE = 128         # Number of query results kept in memory
+SCAN_BATCH_SIZE = 500          # Entries fetched per page when scanning the collection
+WRITE_BATCH_SIZE = 32          # Queued entries that trigger a background write
+WRITE_FLUSH_INTERVAL = 1.0     # Seconds before queued entries are written anyway
+WRITE_RETRIES = 5              # Attempts at writing a queued batch before its entries are dropped
+WRITE_RETRY_BACKOFF = 0.5      # Seconds before the first retry of a failed write, doubled each time
+DEDUPLICATE = True             # Store a message repeated in a session (same role and text) once and
+                               # count it in ref_count
+DEDUPE_NEAR_DISTANCE = None    # Also merge messages this close (cosine distance, e.g. 0.02) to a stored
+                               # one of the session; costs a search per write (None = exact repeats only)
+
+# Embedding settings
+# Entries are only comparable when embedded by the same model, so after changing
+# EMBEDDING_MODEL (or switching to a backend that uses a different model) export
+# the database and import it again with --reembed
+EMBEDDING_BACKEND = "onnx"     # "default" (Chroma's), "onnx", "onnx-int8" or "sentence-transformers"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # Model name; the ONNX backends only support all-MiniLM-L6-v2
+EMBEDDING_THREADS = 0          # CPU threads used for inference (0 = let the runtime decide)
+EMBEDDING_BATCH_SIZE = 32      # Texts encoded together in one inference call
+EMBEDDING_MAX_TOKENS = 256     # Texts are truncated to this many tokens before encoding
+EMBEDDING_CACHE_DIR = None     # Directory for downloaded models (None = the library's default)
+
+# Compaction settings
+COMPACTION_ENABLED = True      # Summarize old sessions in the background
+COMPACTION_AGE_DAYS = 14       # Sessions inactive this long get summarized
+COMPACTION_INTERVAL = 3600     # Seconds between background compaction runs
+COMPACTION_MODEL = DEFAULT_MODEL  # Model used to write the summaries
+COMPACTION_PART_TOKENS = 4000  # Transcript tokens summarized per summary document
+COMPACTION_START_DELAY = 600   # Seconds after startup before the first background run, so it
+                               # doesn't compete with the first replies
+COMPACTION_MAX_SESSIONS = 3    # Sessions compacted per background run (None = all eligible)
+COMPACTION_IDLE_SECONDS = 30   # Chat must be quiet this long before each summary request is sent
+
+# Server settings
+SERVER_HOST = "127.0.0.1"      # Address server.py binds to
+SERVER_PORT = 8080             # Port server.py listens on
+SERVER_MAX_SESSIONS = 100      # Maximum number of live sessions
+SERVER_SESSION_IDLE_TIMEOUT = 3600  # Seconds before an idle session is dropped
 
 # System message for the AI
 SYSTEM_MESSAGE = """You are an AI assistant with a persistent memory system that allows you to recall previous conversations.
@@ -44,3 +127,5 @@ Your responses should be well-structured and use markdown formatting:
 
 # Debug settings
 DEBUG_PRINTS = True  # Whether to print debug information
+LOG_FILE = None      # Also write log output to this file
+METRICS_PORT = None  # Serve metrics on this port while the GUI runs (None = off)
@@ -0,0 +1,61 @@
+import math
+from logs import get_logger
+from config import *
+
+logger = get_logger(__name__)
+
+
+def estimate_tokens(text):
+    """Rough token count for text, without needing the model's tokenizer"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class ContextPacker:
+    """Chooses which retrieved messages fit in the model's context window.
+
+    The budget is whatever OLLAMA_NUM_CTX leaves after the tokens reserved
+    for the reply, a safety margin and the fixed parts of the prompt. Candidates
+    are taken greedily from the best match down; a message that doesn't fit is
+    skipped so that smaller, less similar ones can still use the space.
+    """
+
+    # Tokens for the "[timestamp] Role: " prefix and line break around each message
+    PER_MESSAGE_OVERHEAD = 12
+
+    def __init__(self, num_ctx=OLLAMA_NUM_CTX, reserve=OLLAMA_NUM_PREDICT,
+                 margin=CONTEXT_SAFETY_MARGIN, max_history_tokens=MAX_HISTORY_TOKENS):
+        self.num_ctx = num_ctx
+        self.reserve = reserve
+        self.margin = margin
+        self.max_history_tokens = max_history_tokens
+
+    def budget(self, fixed_texts):
+        """Tokens available for history once fixed_texts are in the prompt"""
+        fixed = sum(estimate_tokens(text) for text in fixed_texts)
+        available = self.num_ctx - self.reserve - self.margin - fixed
+        return max(0, min(available, self.max_history_tokens))
+
+    @staticmethod
+    def record_tokens(record):
+        """Token cost of a stored record, using the estimate saved when it was written"""
+        tokens = record['metadata'].get('tokens')
+        if tokens is None:
+            tokens = estimate_tokens(record['document'])
+            record['metadata']['tokens'] = tokens
+        return tokens
+
+    def pack(self, records, budget):
+        """Return the best-scoring records that fit in budget tokens, best first"""
+        ranked = sorted(records, key=lambda r: r.get('score', -r['distance']), reverse=True)
+        selected = []
+        remaining = budget
+        for record in ranked:
+            cost = self.record_tokens(record) + self.PER_MESSAGE_OVERHEAD
+            if cost <= remaining:
+                selected.append(record)
+                remaining -= cost
+        logger.debug("Packed %d/%d candidates into %d/%d history tokens",
+                     len(selected), len(records), budget - remaining, budget)
+        return selected
@@ -0,0 +1,177 @@
+"""Script to deduplicate the vector database in one pass.
+
+Entries written before DEDUPLICATE was turned on are stored under random IDs,
+so repeated messages were kept as separate entries and new writes can't
+recognize them. This re-keys every message to its content ID, merging
+messages of a session with the same role and text into one entry whose
+ref_count counts the copies. With --near, messages within that cosine
+distance of another message of the same session and role are merged into the
+older one as well.
+
+    python dedupe_db.py --dry-run
+    python dedupe_db.py --near 0.02
+"""
+
+from vector_store import VectorStore, content_id, metadata_filter
+from chunking import chunk_id, merge_chunks
+import argparse
+import time
+from config import SCAN_BATCH_SIZE
+
+
+def _merged_metadata(messages):
+    """Metadata of the oldest message with ref_count and last_seen covering all of them"""
+    metadata = dict(messages[0]['metadata'])
+    metadata['ref_count'] = sum(m['metadata'].get('ref_count', 1) for m in messages)
+    metadata['last_seen'] = max(
+        m['metadata'].get('last_seen', VectorStore.created_at(m['metadata']) or 0) for m in messages
+    )
+    return metadata
+
+
+def dedupe_exact(store, dry_run=False, batch_size=SCAN_BATCH_SIZE):
+    """Re-key messages to their content IDs, merging exact repeats. Returns (rekeyed, removed)."""
+    chunk_ids = {}
+    records = []
+    for record in store.iter_records(batch_size=batch_size):
+        parent_id = record['metadata'].get('parent_id', record['id'])
+        chunk_ids.setdefault(parent_id, []).append(record['id'])
+        records.append(record)
+
+    groups = {}
+    for message in merge_chunks(records):
+        meta = message['metadata']
+        target = content_id(message['document'], meta.get('role'), meta.get('session'))
+        groups.setdefault(target, []).append(message)
+    del records
+
+    rekeyed = removed = 0
+    pending = []
+    for target, messages in groups.items():
+        if len(messages) == 1 and messages[0]['id'] == target:
+            continue
+        messages.sort(key=lambda m: VectorStore.created_at(m['metadata']) or 0)
+        rekeyed += 1
+        removed += len(messages) - 1
+        pending.append((target, messages))
+        if len(pending) >= batch_size and not dry_run:
+            _rewrite(store, pending, chunk_ids)
+            pending = []
+    if pending and not dry_run:
+        _rewrite(store, pending, chunk_ids)
+    return rekeyed, removed
+
+
+def _rewrite(store, groups, chunk_ids):
+    """Store each group's oldest message under its content ID and delete the old entries"""
+    keepers = [chunk_id_ for _, messages in groups for chunk_id_ in chunk_ids[messages[0]['id']]]
+    result = store.collection.get(ids=keepers, include=["documents", "metadatas", "embeddings"])
+    stored = {
+        id_: {"document": doc, "metadata": meta, "embedding": embedding}
+        for id_, doc, meta, embedding in zip(
+            result['ids'], result['documents'], result['metadatas'], result['embeddings']
+        )
+    }
+
+    new_records, old_ids = [], set()
+    for target, messages in groups:
+        metadata = _merged_metadata(messages)
+        for old_id in chunk_ids[messages[0]['id']]:
+            entry = stored[old_id]
+            entry_metadata = {**entry['metadata'], 'ref_count': metadata['ref_count'],
+                              'last_seen': metadata['last_seen']}
+            if 'parent_id' in entry_metadata:
+                entry_metadata['parent_id'] = target
+                new_id = chunk_id(target, entry_metadata['chunk_index'])
+            else:
+                new_id = target
+            new_records.append({"id": new_id, "document": entry['document'],
+                                "metadata": entry_metadata, "embedding": entry['embedding']})
+        for message in messages:
+            old_ids.update(chunk_ids[message['id']])
+
+    # Write first and delete last, so a failure part way leaves duplicates
+    # rather than losing anything
+    store.import_records(new_records)
+    store.delete(sorted(old_ids - {record['id'] for record in new_records}))
+
+
+def dedupe_near(store, distance, dry_run=False, batch_size=SCAN_BATCH_SIZE):
+    """Merge single-chunk messages within distance of an older one of the same session and role.
+
+    Returns the number removed.
+    """
+    counts, last_seen, created = {}, {}, {}
+    candidates = []
+    for record in store.iter_records(batch_size=batch_size, include=("metadatas", "embeddings")):
+        metadata = record['metadata']
+        if 'parent_id' in metadata:
+            continue
+        counts[record['id']] = metadata.get('ref_count', 1)
+        last_seen[record['id']] = metadata.get('last_seen', VectorStore.created_at(metadata) or 0)
+        created[record['id']] = (VectorStore.created_at(metadata) or 0, record['id'])
+        where = metadata_filter(role=metadata.get('role'), session=metadata.get('session'))
+        candidates.append((record['id'], where, record['embedding']))
+
+    # absorbed maps a removed message to the message that took its count
+    absorbed = {}
+    for id_, where, embedding in candidates:
+        if id_ in absorbed:
+            continue
+        results = store.collection.query(
+            query_embeddings=[embedding],
+            n_results=5,
+            where=where,
+            include=["distances"]
+        )
+        for other, other_distance in zip(results['ids'][0], results['distances'][0]):
+            if other == id_ or other in absorbed or other not in counts or other_distance > distance:
+                continue
+            keeper, copy = (id_, other) if created[id_] <= created[other] else (other, id_)
+            counts[keeper] += counts[copy]
+            last_seen[keeper] = max(last_seen[keeper], last_seen[copy])
+            absorbed[copy] = keeper
+            if copy == id_:
+                break
+
+    if absorbed and not dry_run:
+        keepers = sorted(set(absorbed.values()) - set(absorbed))
+        for start in range(0, len(keepers), batch_size):
+            batch = keepers[start:start + batch_size]
+            store.collection.update(
+                ids=batch,
+                metadatas=[{"ref_count": counts[id_], "last_seen": last_seen[id_]} for id_ in batch]
+            )
+        removed = sorted(absorbed)
+        for start in range(0, len(removed), batch_size):
+            store.delete(removed[start:start + batch_size])
+    return len(absorbed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge duplicate messages in the chat history database")
+    parser.add_argument("--near", type=float, default=None, metavar="DISTANCE",
+                        help="Also merge messages within this cosine distance, e.g. 0.02")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without changing it")
+    parser.add_argument("--batch-size", type=int, default=SCAN_BATCH_SIZE,
+                        help=f"Entries read or written per batch (default: {SCAN_BATCH_SIZE})")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = VectorStore()
+    store.flush()
+    before = store.collection.count()
+    rekeyed, removed = dedupe_exact(store, args.dry_run, args.batch_size)
+    print(f"Exact duplicates: {removed} messages merged, {rekeyed} messages re-keyed to content IDs")
+    if args.near is not None:
+        if args.dry_run and removed:
+            print("Near duplicates: skipped in a dry run with exact duplicates pending")
+        else:
+            near = dedupe_near(store, args.near, args.dry_run, args.batch_size)
+            print(f"Near duplicates: {near} messages merged")
+    if not args.dry_run:
+        print(f"{before} -> {store.collection.count()} entries in {time.perf_counter() - start:.1f}s")
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Embedding backends for the vector store, selected by EMBEDDING_BACKEND.
+
+All backends are Chroma embedding functions returning normalized vectors:
+
+- "default": Chroma's built-in all-MiniLM-L6-v2 ONNX model, as before
+- "onnx": the same model and weights, run with a tuned ONNX Runtime session.
+  Texts are sorted by length and padded only to the longest text in each
+  batch, not to EMBEDDING_MAX_TOKENS
+- "onnx-int8": "onnx" with the weights quantized to int8 on first use
+- "sentence-transformers": any sentence-transformers model, run with PyTorch
+
+Each function has a model_name attribute naming the vector space it
+produces, so stores can tell whether existing entries are comparable.
+"""
+
+from chromadb.api.types import EmbeddingFunction
+from chromadb.utils import embedding_functions
+from logs import get_logger
+import importlib
+import numpy
+import os
+from config import *
+
+logger = get_logger(__name__)
+
+BACKENDS = ("default", "onnx", "onnx-int8", "sentence-transformers")
+ONNX_MODEL_NAME = embedding_functions.ONNXMiniLM_L6_V2.MODEL_NAME
+
+
+class OnnxEmbeddingFunction(embedding_functions.ONNXMiniLM_L6_V2):
+    """all-MiniLM-L6-v2 on ONNX Runtime with thread control, dynamic padding and optional int8 weights"""
+
+    def __init__(self, quantize=False, threads=EMBEDDING_THREADS, batch_size=EMBEDDING_BATCH_SIZE,
+                 max_tokens=EMBEDDING_MAX_TOKENS, cache_dir=EMBEDDING_CACHE_DIR):
+        super().__init__(preferred_providers=["CPUExecutionProvider"])
+        self.quantize = quantize
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        # Quantized vectors differ from full-precision ones, so they count as another model
+        self.model_name = f"{self.MODEL_NAME}-int8" if quantize else self.MODEL_NAME
+        if cache_dir:
+            self.DOWNLOAD_PATH = os.path.join(cache_dir, "onnx_models", self.MODEL_NAME)
+
+    def _model_path(self):
+        folder = os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME)
+        path = os.path.join(folder, "model.onnx")
+        if not self.quantize:
+            return path
+
+        quantized = os.path.join(folder, "model_int8.onnx")
+        if not os.path.exists(quantized):
+            try:
+                quantization = importlib.import_module("onnxruntime.quantization")
+            except ImportError:
+                raise ValueError(
+                    "Quantizing the embedding model needs the onnx package. Please install it with `pip install onnx`"
+                )
+            logger.info("Quantizing embedding model to %s", quantized)
+            # Write to a temporary name first so an interrupted run isn't mistaken for a finished one
+            partial = quantized + ".partial"
+            quantization.quantize_dynamic(path, partial, weight_type=quantization.QuantType.QInt8)
+            os.replace(partial, quantized)
+        return quantized
+
+    def _init_model_and_tokenizer(self):
+        if self.model is not None and self.tokenizer is not None:
+            return
+        tokenizer = self.Tokenizer.from_file(
+            os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "tokenizer.json")
+        )
+        tokenizer.enable_truncation(max_length=self.max_tokens)
+        # No fixed length: encode_batch pads to the longest text in the batch
+        tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+        options = self.ort.SessionOptions()
+        options.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        self.model = self.ort.InferenceSession(
+            self._model_path(), sess_options=options, providers=self._preferred_providers
+        )
+        self.tokenizer = tokenizer
+
+    def _forward(self, documents, batch_size=EMBEDDING_BATCH_SIZE):
+        encoded = self.tokenizer.encode_batch(documents)
+        input_ids = numpy.array([e.ids for e in encoded], dtype=numpy.int64)
+        attention_mask = numpy.array([e.attention_mask for e in encoded], dtype=numpy.int64)
+        last_hidden_state = self.model.run(None, {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": numpy.zeros_like(input_ids),
+        })[0]
+        # Mean pooling over the real tokens
+        mask = attention_mask[:, :, None].astype(numpy.float32)
+        embeddings = (last_hidden_state * mask).sum(1) / numpy.clip(mask.sum(1), 1e-9, None)
+        return self._normalize(embeddings).astype(numpy.float32)
+
+    def __call__(self, input):
+        if not input:
+            return []
+        self._download_model_if_not_exists()
+        self._init_model_and_tokenizer()
+
+        # Batching texts of similar length keeps padding, and so wasted work, small
+        order = sorted(range(len(input)), key=lambda i: len(input[i]))
+        results = [None] * len(input)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, embedding in zip(batch, self._forward([input[i] for i in batch])):
+                results[i] = embedding.tolist()
+        return results
+
+
+class SentenceTransformerEmbeddingFunction(EmbeddingFunction):
+    """Any sentence-transformers model, run on the CPU with PyTorch"""
+
+    def __init__(self, model_name=EMBEDDING_MODEL, threads=EMBEDDING_THREADS,
+                 batch_size=EMBEDDING_BATCH_SIZE, max_tokens=EMBEDDING_MAX_TOKENS, cache_dir=EMBEDDING_CACHE_DIR):
+        try:
+            sentence_transformers = importlib.import_module("sentence_transformers")
+            torch = importlib.import_module("torch")
+        except ImportError:
+            raise ValueError(
+                "The sentence_transformers python package is not installed. "
+                "Please install it with `pip install sentence_transformers`"
+            )
+        if threads:
+            torch.set_num_threads(threads)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = sentence_transformers.SentenceTransformer(model_name, device="cpu", cache_folder=cache_dir)
+        self.model.max_seq_length = min(self.model.max_seq_length or max_tokens, max_tokens)
+
+    def __call__(self, input):
+        if not input:
+            return []
+        return self.model.encode(
+            list(input), batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        ).tolist()
+
+
+def create_embedding_function(backend=EMBEDDING_BACKEND, model_name=EMBEDDING_MODEL, **options):
+    """Build the embedding function for a backend name.
+
+    options (threads, batch_size, max_tokens, cache_dir) override the config
+    values for the backends that support them.
+    """
+    if backend == "default":
+        function = embedding_functions.DefaultEmbeddingFunction()
+        function.model_name = ONNX_MODEL_NAME
+        return function
+    if backend in ("onnx", "onnx-int8"):
+        if model_name != ONNX_MODEL_NAME:
+            raise ValueError(f"The {backend} backend only supports {ONNX_MODEL_NAME}")
+        return OnnxEmbeddingFunction(quantize=backend == "onnx-int8", **options)
+    if backend == "sentence-transformers":
+        return SentenceTransformerEmbeddingFunction(model_name, **options)
+    raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {', '.join(BACKENDS)}")
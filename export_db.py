@@ -0,0 +1,150 @@
+"""Script to export the vector database to a file and import it back.
+
+Entries are streamed in batches to gzip-compressed NDJSON, one entry per
+line, with their stored embeddings, so an import doesn't have to run the
+embedding model again. The file starts with a header line describing it.
+
+    python export_db.py export backup.ndjson.gz
+    python export_db.py import backup.ndjson.gz
+"""
+
+from vector_store import VectorStore
+import argparse
+import base64
+import gzip
+import json
+import numpy
+import sys
+import time
+from config import SCAN_BATCH_SIZE, COLLECTION_NAME
+
+FORMAT_NAME = "persistence-export"
+FORMAT_VERSION = 1
+
+
+def encode_embedding(embedding):
+    """Pack an embedding as base64 little-endian float32, far smaller and faster than a JSON list"""
+    return base64.b64encode(numpy.asarray(embedding, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_embedding(text):
+    return numpy.frombuffer(base64.b64decode(text), dtype="<f4").tolist()
+
+
+def export_database(path, batch_size=SCAN_BATCH_SIZE, include_archive=True, compresslevel=6):
+    """Write every entry to path. Returns the number written."""
+    store = VectorStore()
+    store.flush()
+    include = ("documents", "metadatas", "embeddings")
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=compresslevel) as f:
+        header = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "collection": COLLECTION_NAME,
+                  "embedding_model": store.embedding_function.model_name, "exported_at": time.time()}
+        f.write(json.dumps(header) + "\n")
+        
+        sources = [False, True] if include_archive else [False]
+        for archived in sources:
+            for record in store.iter_records(batch_size=batch_size, include=include, archived=archived):
+                line = {
+                    "id": record['id'],
+                    "document": record['document'],
+                    "metadata": record['metadata'],
+                    "embedding": encode_embedding(record['embedding']),
+                }
+                if archived:
+                    line["archived"] = True
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                count += 1
+                if count % 10000 == 0:
+                    print(f"Exported {count} entries...", file=sys.stderr)
+    return count
+
+
+def read_header(path):
+    """Return the header of an export file, checking that it can be read"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+    if header.get("format") != FORMAT_NAME:
+        raise ValueError(f"{path} is not a chat history export")
+    if header.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"{path} was written by a newer version (format {header['version']})")
+    return header
+
+
+def read_export(path, embeddings=True):
+    """Yield the entries of an export file as records with decoded embeddings"""
+    read_header(path)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        f.readline()
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if embeddings and record.get("embedding") is not None:
+                record["embedding"] = decode_embedding(record["embedding"])
+            else:
+                record.pop("embedding", None)
+            yield record
+
+
+def import_database(path, batch_size=SCAN_BATCH_SIZE, reembed=False):
+    """Load the entries of an export file into the store. Returns the number imported.
+
+    With reembed set the stored embeddings are ignored and every entry is
+    encoded again with the configured embedding model.
+    """
+    store = VectorStore()
+    exported_model = read_header(path).get("embedding_model")
+    if not reembed and exported_model and exported_model != store.embedding_function.model_name:
+        raise ValueError(
+            f"{path} was embedded with {exported_model} but {store.embedding_function.model_name} "
+            "is configured; import with --reembed"
+        )
+    
+    batches = {False: [], True: []}
+    count = 0
+    for record in read_export(path, embeddings=not reembed):
+        batch = batches[bool(record.pop("archived", False))]
+        batch.append(record)
+        if len(batch) >= batch_size:
+            store.import_records(batch, archived=batch is batches[True])
+            count += len(batch)
+            batch.clear()
+            if count % 10000 < batch_size:
+                print(f"Imported {count} entries...", file=sys.stderr)
+    for archived, batch in batches.items():
+        store.import_records(batch, archived=archived)
+        count += len(batch)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the chat history database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    export_parser = subparsers.add_parser("export", help="Write all entries to a compressed NDJSON file")
+    export_parser.add_argument("path", help="File to write, e.g. backup.ndjson.gz")
+    export_parser.add_argument("--no-archive", action="store_true", help="Leave out archived raw entries")
+    export_parser.add_argument("--compress-level", type=int, default=6, choices=range(1, 10),
+                               help="gzip level; lower is faster (default: 6)")
+    
+    import_parser = subparsers.add_parser("import", help="Load entries from an export file")
+    import_parser.add_argument("path", help="File written by the export command")
+    import_parser.add_argument("--reembed", action="store_true",
+                               help="Encode entries again instead of reusing their embeddings")
+    
+    for sub in (export_parser, import_parser):
+        sub.add_argument("--batch-size", type=int, default=SCAN_BATCH_SIZE,
+                         help=f"Entries read or written per batch (default: {SCAN_BATCH_SIZE})")
+    args = parser.parse_args()
+    
+    start = time.perf_counter()
+    if args.command == "export":
+        count = export_database(args.path, args.batch_size, not args.no_archive, args.compress_level)
+        print(f"Exported {count} entries to {args.path} in {time.perf_counter() - start:.1f}s")
+    else:
+        count = import_database(args.path, args.batch_size, args.reembed)
+        print(f"Imported {count} entries from {args.path} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
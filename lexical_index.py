@@ -0,0 +1,189 @@
+import heapq
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from config import *
+
+# Identifier-like tokens such as error codes, file names and dotted names are
+# kept whole as well as split into their word parts
+_COMPOUND_RE = re.compile(r"\w+(?:[.\-:/]\w+)+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lowercased word tokens, plus whole compound identifiers like ERR-42 or foo.bar"""
+    text = text.lower()
+    return _WORD_RE.findall(text) + _COMPOUND_RE.findall(text)
+
+
+class BM25Index:
+    """Persistent BM25 inverted index over the stored documents, kept in SQLite.
+
+    Postings are updated incrementally as documents are added or removed, so
+    a lexical lookup only reads the postings for the query's terms. Each
+    posting also stores its BM25 term weight at the time it was written, and
+    a search reads at most max_postings postings per term in that order, so
+    its cost doesn't grow with the corpus. Rare terms have fewer postings
+    than that and are scored exactly; for common ones, whose low IDF adds
+    little, only the documents they weigh most in count.
+
+    Every row is tagged with the time shard its document lives in (empty for
+    an unsharded store), so a whole shard is dropped with one DELETE per
+    table. Document frequencies are kept per shard and summed when searching.
+    """
+
+    def __init__(self, path, k1=BM25_K1, b=BM25_B, max_postings=BM25_MAX_POSTINGS):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(postings)")]
+            if columns and "shard" not in columns:
+                # Indexes from before postings were impact-ordered and tagged
+                # with shards are dropped; VectorStore rebuilds an empty index
+                # from the collection
+                for table in ("postings", "terms", "docs"):
+                    self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, length INTEGER NOT NULL, shard TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS terms ("
+                "term TEXT NOT NULL, shard TEXT NOT NULL, df INTEGER NOT NULL, "
+                "PRIMARY KEY (term, shard)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                "term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+                "length INTEGER NOT NULL, impact REAL NOT NULL, shard TEXT NOT NULL, "
+                "PRIMARY KEY (term, doc_id)) WITHOUT ROWID"
+            )
+            # Covers the search query, so reading a term's best postings never touches the table
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS postings_term_impact ON postings (term, impact DESC, doc_id, tf, length)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id)"
+            )
+            for table in ("docs", "terms", "postings"):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_shard ON {table} (shard)")
+        self._load_stats()
+
+    def _load_stats(self):
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs"
+            ).fetchone()
+        self._doc_count = count
+        self._total_length = total
+
+    def __len__(self):
+        return self._doc_count
+
+    def add(self, ids, documents, shards=None):
+        """Index documents, replacing any already indexed under the same IDs.
+
+        shards gives each document's time shard key; None means unsharded.
+        """
+        shards = shards or [""] * len(ids)
+        with self._lock, self._conn:
+            self._remove_locked(ids)
+            for doc_id, document, shard in zip(ids, documents, shards):
+                counts = Counter(tokenize(document))
+                length = sum(counts.values())
+                self._conn.execute(
+                    "INSERT INTO docs (id, length, shard) VALUES (?, ?, ?)", (doc_id, length, shard)
+                )
+                self._doc_count += 1
+                self._total_length += length
+                avg_length = self._total_length / self._doc_count
+                self._conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf, length, impact, shard) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(term, doc_id, tf, length, self._term_weight(tf, length, avg_length), shard)
+                     for term, tf in counts.items()]
+                )
+                self._conn.executemany(
+                    "INSERT INTO terms (term, shard, df) VALUES (?, ?, 1) "
+                    "ON CONFLICT(term, shard) DO UPDATE SET df = df + 1",
+                    [(term, shard) for term in counts]
+                )
+
+    def _term_weight(self, tf, length, avg_length):
+        """The BM25 score of one term in a document, before it is multiplied by the term's IDF"""
+        return tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+
+    def remove(self, ids):
+        """Drop documents from the index"""
+        with self._lock, self._conn:
+            self._remove_locked(ids)
+
+    def _remove_locked(self, ids):
+        decremented = set()
+        for doc_id in ids:
+            row = self._conn.execute("SELECT length, shard FROM docs WHERE id = ?", (doc_id,)).fetchone()
+            if row is None:
+                continue
+            terms = [(t, row[1]) for (t,) in self._conn.execute(
+                "SELECT term FROM postings WHERE doc_id = ?", (doc_id,)
+            )]
+            self._conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ? AND shard = ?", terms)
+            decremented.update(terms)
+            self._conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+            self._conn.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+            self._doc_count -= 1
+            self._total_length -= row[0]
+        # Only the rows just decremented can have reached zero; they are found
+        # through the primary key instead of scanning the whole table
+        self._conn.executemany(
+            "DELETE FROM terms WHERE term = ? AND shard = ? AND df <= 0", sorted(decremented)
+        )
+
+    def drop_shard(self, shard):
+        """Drop every document of a time shard without visiting them one by one"""
+        with self._lock, self._conn:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE shard = ?", (shard,)
+            ).fetchone()
+            for table in ("postings", "terms", "docs"):
+                self._conn.execute(f"DELETE FROM {table} WHERE shard = ?", (shard,))
+            self._doc_count -= count
+            self._total_length -= total
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM terms")
+            self._conn.execute("DELETE FROM docs")
+            self._doc_count = 0
+            self._total_length = 0
+
+    def search(self, query_text, k):
+        """Return up to k (doc_id, score) pairs, best first"""
+        terms = set(tokenize(query_text))
+        if not terms or not self._doc_count:
+            return []
+
+        n = self._doc_count
+        avg_length = self._total_length / n
+        placeholders = ",".join("?" * len(terms))
+        scores = {}
+        with self._lock:
+            df = dict(self._conn.execute(
+                f"SELECT term, SUM(df) FROM terms WHERE term IN ({placeholders}) GROUP BY term", tuple(terms)
+            ))
+            if not df:
+                return []
+            for term in df:
+                idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+                for doc_id, tf, length in self._conn.execute(
+                    "SELECT doc_id, tf, length FROM postings WHERE term = ? ORDER BY impact DESC LIMIT ?",
+                    (term, self.max_postings)
+                ):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * self._term_weight(tf, length, avg_length)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,62 @@
+"""Application logging, written from a background thread.
+
+Modules log through get_logger(__name__). A log call only puts the record on
+a queue; a QueueListener thread formats it and writes it to stderr (and
+LOG_FILE, if set), so the calling thread never waits on formatting, the
+console or disk. Arguments are formatted late, so pass values that won't
+change afterwards. DEBUG_PRINTS turns on debug-level output; warnings and
+errors always show.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from config import DEBUG_PRINTS, LOG_FILE
+
+ROOT_LOGGER = "persistence"
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare() formats the message in the thread that logs.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=None, log_file=LOG_FILE):
+    """Attach the queue handler and start the writer thread; later calls do nothing"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        handlers = [logging.StreamHandler(sys.stderr)]
+        if log_file:
+            handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(level if level is not None else (logging.DEBUG if DEBUG_PRINTS else logging.WARNING))
+        root.addHandler(_DeferredQueueHandler(log_queue))
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # Flush what is still queued when the process exits
+        atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
@@ -4,10 +4,16 @@ import sys
 import os
 import tkinter as tk
 from tkinter import ttk, scrolledtext
-from chat_interface import ChatInterface
+from startup import DependencyError, StartupPipeline
+from config import (STREAM_RESPONSES, COMPACTION_ENABLED, DEFAULT_MODEL, MODEL_WARMUP,
+                    SPECULATIVE_RETRIEVAL, PREFETCH_DEBOUNCE_MS, METRICS_PORT)
 import threading
 import queue
 
+# The chat, vector store and Ollama modules pull in Chroma, the embedding
+# runtime and httpx, so they are imported by the startup tasks rather than
+# here, letting the window open before any of them has loaded
+
 class ChatGUI:
     def __init__(self, root):
         self.root = root
@@ -16,6 +22,7 @@ class ChatGUI:
         
         # Initialize chat as None
         self.chat = None
+        self.warmup_error = None
         
         # Configure dark theme colors
         self.bg_color = "#1a1a1a"  # Dark background
@@ -90,6 +97,12 @@ class ChatGUI:
         # Bind Enter key to send message
         self.input_field.bind('<Return>', lambda e: self.send_message())
         
+        # Search history for the draft during pauses in typing, so the search
+        # is usually done by the time the message is sent
+        self._prefetch_after = None
+        if SPECULATIVE_RETRIEVAL:
+            self.input_field.bind('<KeyRelease>', self.on_draft_changed)
+        
         # Create buttons frame
         self.buttons_frame = ttk.Frame(self.main_container, style="Custom.TFrame")
         self.buttons_frame.grid(row=1, column=1, sticky=(tk.E))
@@ -124,72 +137,119 @@ class ChatGUI:
         self.process_messages()
 
     def initialize_chat(self):
-        def setup():
-            try:
-                self.append_to_chat("Checking Ollama server...\n")
-                if not check_ollama_running():
-                    self.append_to_chat("Starting Ollama server...\n")
-                    if not start_ollama():
-                        self.append_to_chat("Failed to start Ollama. Please start it manually.\n")
-                        return
-                else:
-                    self.append_to_chat("Ollama server is running.\n")
-                
-                self.append_to_chat("Checking model availability...\n")
-                if not ensure_model_pulled():
-                    self.append_to_chat("Failed to ensure model availability.\n")
-                    return
-                self.append_to_chat("Model is available.\n")
-                
-                self.append_to_chat("Initializing chat interface...\n")
-                try:
-                    self.chat = ChatInterface()
-                    self.append_to_chat("Chat interface initialized successfully!\n")
-                except Exception as e:
-                    self.append_to_chat(f"Error initializing chat interface: {str(e)}\n")
-                    return
-                
-                self.append_to_chat("Chat interface ready! You can start chatting.\n")
-                
-                # Enable input on the main thread
-                self.root.after(0, lambda: [
-                    self.input_field.config(state='normal'),
-                    self.send_button.config(state='normal'),
-                    self.new_session_button.config(state='normal'),
-                    self.input_field.focus_set()
-                ])
-            except Exception as e:
-                self.append_to_chat(f"Initialization error: {str(e)}\n")
-        
-        # Start initialization in a separate thread
-        threading.Thread(target=setup, daemon=True).start()
+        """Start the startup tasks in the background; the window stays usable meanwhile.
 
-    def send_message(self):
-        if self.chat is None:
-            self.append_to_chat("Please wait for initialization to complete...\n")
+        Checking Ollama and the model runs alongside loading the vector store
+        and embedding model, and messages sent before both are done are
+        answered once they are.
+        """
+        self.msg_queue.put("Starting up...\n")
+        self.startup = StartupPipeline(on_event=self.on_startup_event)
+        self.startup.add("ollama", start_ollama_server)
+        self.startup.add("model", prepare_model, depends_on=["ollama"])
+        self.startup.add("store", load_vector_store)
+        self.startup.add("chat", self.create_chat, depends_on=["store"])
+        if MODEL_WARMUP:
+            # Loading the model here keeps its load time out of the first reply
+            self.startup.add("warmup", self.warm_up_model, depends_on=["model", "chat"])
+            self.startup.add("ready", lambda: None, depends_on=["warmup"])
+        else:
+            self.startup.add("ready", lambda: None, depends_on=["model", "chat"])
+        if COMPACTION_ENABLED:
+            self.startup.add("compaction", start_compaction, depends_on=["ready"])
+        if METRICS_PORT:
+            self.startup.add("metrics", start_metrics_server)
+        self.startup.start()
+
+    STARTUP_MESSAGES = {
+        "ollama": "Ollama server is running.",
+        "model": "Model is available.",
+        "store": "Vector store loaded.",
+        "chat": "Chat interface initialized.",
+        "warmup": "Model loaded.",
+        "compaction": "Background compaction started.",
+        "metrics": f"Metrics served on port {METRICS_PORT}.",
+    }
+
+    def on_startup_event(self, name, error, seconds):
+        print(f"Startup: {name} {'failed' if error else 'done'} in {seconds:.2f}s")
+        if error is not None:
+            # Dependents fail along with the task that caused it, which is reported alone
+            if not isinstance(error, DependencyError):
+                self.msg_queue.put(f"Startup error ({name}): {error}\n")
             return
-            
+        if name == "warmup" and self.warmup_error is not None:
+            self.msg_queue.put(f"Could not preload the model ({self.warmup_error}); "
+                               "the first reply will load it.\n")
+        elif name == "ready":
+            total = self.startup.elapsed()
+            self.msg_queue.put(f"Chat interface ready! ({total:.1f}s: {self.startup.summary()})\n")
+        else:
+            self.msg_queue.put(f"{self.STARTUP_MESSAGES[name]} ({seconds:.2f}s)\n")
+
+    def create_chat(self):
+        from chat_interface import ChatInterface
+        self.chat = ChatInterface()
+
+    def warm_up_model(self):
+        # Warming up is only an optimization, so a failure mustn't hold up "ready";
+        # the first reply loads the model instead
+        try:
+            self.chat.warm_up()
+        except Exception as e:
+            self.warmup_error = e
+        # Re-warm after idle periods, and after Ollama restarts (including the
+        # ones process_message triggers), so a reload never lands on a reply
+        self.chat.keep_warm()
+
+    def on_draft_changed(self, event=None):
+        # Debounced: only a pause of PREFETCH_DEBOUNCE_MS starts a search
+        if self._prefetch_after is not None:
+            self.root.after_cancel(self._prefetch_after)
+        self._prefetch_after = self.root.after(PREFETCH_DEBOUNCE_MS, self.prefetch_draft)
+
+    def prefetch_draft(self):
+        self._prefetch_after = None
+        if self.chat is not None:
+            self.chat.prefetch(self.input_field.get())
+
+    def send_message(self):
         message = self.input_field.get().strip()
         if not message:
             return
             
         self.input_field.delete(0, tk.END)
+        if self._prefetch_after is not None:
+            self.root.after_cancel(self._prefetch_after)
+            self._prefetch_after = None
         self.append_to_chat(f"\nYou: {message}\n\n")
+        if not self.startup.done("ready"):
+            self.append_to_chat("(Startup is still finishing; the reply will follow when it's done.)\n\n")
         
         # Process message in a separate thread
         threading.Thread(target=self.process_message, args=(message,), daemon=True).start()
 
     def process_message(self, message):
-        if self.chat is None:
-            self.msg_queue.put("Chat interface not ready. Please wait...\n")
+        try:
+            self.startup.wait("ready")
+        except Exception as e:
+            self.msg_queue.put(f"Chat interface not available: {e}\n\n")
             return
             
         try:
-            response = self.chat.chat(message)
-            self.msg_queue.put(f"Assistant: {response}\n\n")
+            if STREAM_RESPONSES:
+                # Chunks are appended to the display as they arrive
+                self.msg_queue.put("Assistant: ")
+                for chunk in self.chat.chat_stream(message):
+                    self.msg_queue.put(chunk)
+                self.msg_queue.put("\n\n")
+            else:
+                response = self.chat.chat(message)
+                self.msg_queue.put(f"Assistant: {response}\n\n")
         except Exception as e:
             self.msg_queue.put(f"Error: {str(e)}\n\n")
-            if not check_ollama_running():
+            from ollama_service import OllamaService
+            if not OllamaService().is_alive():
                 self.msg_queue.put("Ollama server appears to be down. Attempting to restart...\n")
                 if start_ollama():
                     self.msg_queue.put("Ollama restarted successfully! Please try your message again.\n\n")
@@ -197,6 +257,9 @@ class ChatGUI:
                     self.msg_queue.put("Failed to restart Ollama. Please check your installation.\n\n")
 
     def new_session(self):
+        if self.chat is None:
+            self.append_to_chat("Please wait for initialization to complete...\n")
+            return
         self.chat.new_session()
         self.append_to_chat("\nStarted new session.\n\n")
 
@@ -217,79 +280,86 @@ class ChatGUI:
             self.root.after(100, self.process_messages)
 
 def check_ollama_running():
-    print("Checking if Ollama process exists...")
-    try:
-        result = subprocess.run(["tasklist", "/FI", "IMAGENAME eq ollama.exe"], capture_output=True, text=True)
-        if "ollama.exe" in result.stdout:
-            print("Ollama process found")
-            return True
-        print("Ollama process not found")
-        return False
-    except Exception as e:
-        print(f"Error checking Ollama process: {e}")
-        return False
+    from ollama_service import OllamaService
+    print("Checking if Ollama server is responding...")
+    if OllamaService().is_alive(refresh=True):
+        print("Ollama server is responding")
+        return True
+    print("Ollama server is not responding")
+    return False
 
 def start_ollama():
+    from ollama_service import OllamaService
     print("Attempting to start Ollama server...")
     try:
         subprocess.Popen(["ollama", "serve"], 
-                        creationflags=subprocess.CREATE_NEW_CONSOLE)
+                        creationflags=getattr(subprocess, "CREATE_NEW_CONSOLE", 0))
         print("Ollama server process started")
         
         # Wait for server to be ready
-        max_attempts = 5
-        for attempt in range(max_attempts):
-            print(f"Checking server readiness (attempt {attempt + 1}/{max_attempts})...")
-            try:
-                import ollama
-                models = ollama.list()
-                print("Server is responsive!")
-                return True
-            except Exception as e:
-                print(f"Server not ready yet: {e}")
-                time.sleep(2)
+        if OllamaService().wait_until_alive():
+            print("Server is responsive!")
+            return True
         print("Failed to verify server readiness")
         return False
     except Exception as e:
         print(f"Error starting Ollama: {e}")
         return False
 
-def ensure_model_pulled(model_name="qwq:latest"):
+def start_ollama_server():
+    """Make sure Ollama is up, starting it if needed, then keep watching it"""
+    from ollama_service import OllamaService
+    if not check_ollama_running() and not start_ollama():
+        raise RuntimeError("Failed to start Ollama. Please start it manually.")
+    # Keep server liveness current in the background from now on
+    OllamaService().start_monitor()
+
+def ensure_model_pulled(model_name=DEFAULT_MODEL):
+    from ollama_service import OllamaService
     print(f"Checking if model {model_name} is available...")
     try:
-        import ollama
-        models = ollama.list()
-        print("Available models:", [m.get('name', '') for m in models['models']])
+        service = OllamaService()
+        models = service.list_models(refresh=True)
+        print("Available models:", [m.get('name', '') for m in models])
         
-        if any(m.get('name', '') == model_name for m in models['models']):
+        if any(m.get('name', '') == model_name for m in models):
             print(f"Model {model_name} is already pulled")
             return True
             
         print(f"Pulling model {model_name}...")
-        ollama.pull(model_name)
+        service.pull(model_name)
         print(f"Successfully pulled {model_name}")
         return True
     except Exception as e:
         print(f"Error checking/pulling model: {e}")
         return False
 
+def prepare_model():
+    if not ensure_model_pulled(DEFAULT_MODEL):
+        raise RuntimeError("Failed to ensure model availability")
+
+def load_vector_store():
+    """Open the vector store and run the embedding model once so the first search isn't slow"""
+    from vector_store import VectorStore
+    store = VectorStore()
+    store.embedding_function(["warm up"])
+    return store
+
+def start_compaction():
+    # Summarize old sessions in the background so the store stays small
+    from compaction import CompactionJob
+    CompactionJob().start()
+
+def start_metrics_server():
+    import metrics
+    metrics.start_http_server(METRICS_PORT)
+
 def main():
+    start = time.perf_counter()
     root = tk.Tk()
     app = ChatGUI(root)
-    
-    print("\nStarting initialization...")
-    if not check_ollama_running():
-        print("Starting Ollama server...")
-        if not start_ollama():
-            print("Failed to start Ollama server")
-            return
-        
-    print("\nChecking model availability...")
-    if not ensure_model_pulled():
-        print("Failed to ensure model availability")
-        return
-        
-    print("\nInitializing chat interface...")
+    root.update_idletasks()
+    print(f"Window ready in {time.perf_counter() - start:.2f}s; startup continues in the background")
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+"""Script to measure how many prompt tokens Ollama prefills on each turn.
+
+Runs the same scripted conversation with each prompt layout and prints,
+per turn, the estimated prompt size and the prompt_eval_count Ollama
+reports, which only counts tokens not served from its cached prefix.
+Messages are not stored in the vector store.
+
+    python measure_prefill.py --turns 8
+"""
+
+from chat_interface import ChatInterface
+from ollama_service import OllamaService
+import argparse
+import json
+from config import DEFAULT_MODEL
+
+PROMPTS = [
+    "I'm planning a trip to Japan in the spring. What should I pack?",
+    "How many days would you spend in Kyoto?",
+    "What about day trips from there?",
+    "Can you suggest a food to try in each place?",
+    "Which of those is easiest to reach by train?",
+    "How much should I budget per day?",
+    "Is it worth buying a rail pass for that plan?",
+    "Summarize the plan we've made so far.",
+]
+
+
+def run_layout(layout, model_name, prompts):
+    chat = ChatInterface(model_name, prompt_layout=layout, remember=False)
+    results = []
+    for turn, prompt in enumerate(prompts, 1):
+        chat.chat(prompt)
+        stats = dict(chat.prompt_stats[-1]) if chat.prompt_stats else {}
+        stats["turn"] = turn
+        results.append(stats)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prompt prefill per turn across prompt layouts")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help=f"Model to chat with (default: {DEFAULT_MODEL})")
+    parser.add_argument("--ollama-host", default=None, help="Ollama server URL (default: $OLLAMA_HOST)")
+    parser.add_argument("--turns", type=int, default=len(PROMPTS), help="Turns per layout (default: %(default)s)")
+    parser.add_argument("--layouts", nargs="+", choices=["template", "stable"], default=["template", "stable"])
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    OllamaService(args.ollama_host)
+    prompts = [PROMPTS[i % len(PROMPTS)] for i in range(args.turns)]
+    results = {layout: run_layout(layout, args.model, prompts) for layout in args.layouts}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for layout, turns in results.items():
+        print(f"\n{layout} layout")
+        print(f"{'turn':>4} {'prompt tokens':>14} {'prefilled':>10} {'prefill ms':>11}")
+        for stats in turns:
+            print(f"{stats['turn']:>4} {stats.get('prompt_tokens', 0):>14} "
+                  f"{stats.get('prompt_eval_count', 0):>10} {stats.get('prompt_eval_ms', 0):>11.0f}")
+        print(f"total prefilled: {sum(s.get('prompt_eval_count', 0) for s in turns)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""In-process counters and latency histograms, exportable as Prometheus text or JSON.
+
+Metrics are created once at module level and are safe to update from any
+thread. Phases of a request are timed with span():
+
+    with span("retrieval"):
+        ...
+
+which records the duration in the phase_seconds histogram under that
+phase label.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logs import get_logger
+import bisect
+import json
+import threading
+import time
+
+logger = get_logger(__name__)
+
+# Latency buckets in seconds, from a fast cache hit to a long generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """A count that only goes up, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(dict(key), value) for key, value in self._values.items()]
+
+    def prometheus_lines(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Observed values counted into cumulative buckets, optionally split by labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            results = []
+            for key, (counts, total, count) in self._series.items():
+                cumulative, buckets = 0, {}
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    buckets[str(bound)] = cumulative
+                results.append((dict(key), {"count": count, "sum": total, "buckets": buckets}))
+            return results
+
+    def prometheus_lines(self):
+        lines = []
+        for labels, data in sorted(self.samples(), key=lambda sample: _label_key(sample[0])):
+            key = _label_key(labels)
+            for bound, cumulative in data["buckets"].items():
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {data['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {data['count']}")
+        return lines
+
+
+def _register(metric_class, name, help_text, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = metric_class(name, help_text, **kwargs)
+        return metric
+
+
+def counter(name, help_text):
+    """Return the counter called name, creating it on first use"""
+    return _register(Counter, name, help_text)
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """Return the histogram called name, creating it on first use"""
+    return _register(Histogram, name, help_text, buckets=buckets)
+
+
+PHASE_SECONDS = histogram("phase_seconds", "Time spent in each phase of handling a chat message")
+
+
+class span:
+    """Context manager timing a phase into PHASE_SECONDS; the duration is kept in .seconds"""
+
+    def __init__(self, phase, **labels):
+        self.phase = phase
+        self.labels = labels
+        self.seconds = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        PHASE_SECONDS.observe(self.seconds, phase=self.phase, **self.labels)
+        logger.debug("%s took %.1f ms", self.phase, self.seconds * 1000)
+        return False
+
+
+def to_prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.prometheus_lines())
+    return "\n".join(lines) + "\n"
+
+
+def to_json():
+    """All metrics as a JSON string"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return json.dumps({
+        metric.name: {
+            "type": metric.kind,
+            "help": metric.help,
+            "samples": [{"labels": labels, "value": value} for labels, value in metric.samples()],
+        }
+        for metric in metrics
+    }, indent=2)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/metrics.json"):
+            self.send_error(404)
+            return
+        as_json = self.path.startswith("/metrics.json") or "format=json" in self.path
+        body = (to_json() if as_json else to_prometheus()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json" if as_json else "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
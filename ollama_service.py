@@ -0,0 +1,379 @@
+import ollama
+import httpx
+from contextlib import contextmanager
+from logs import get_logger
+from metrics import span
+import threading
+import time
+from config import *
+
+logger = get_logger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Ollama while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Stops sending requests to a failing server until it has had time to recover.
+
+    After failure_threshold consecutive failures the breaker opens and every
+    request fails fast. Once reset_timeout has passed a single trial request
+    is let through (half-open); its outcome closes or re-opens the breaker.
+    Health checks only ever open it, or move it to half-open early when the
+    server answers again after a failed check; closing is left to requests.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=OLLAMA_BREAKER_FAILURES, reset_timeout=OLLAMA_BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._tripped = False  # Opened by a failed health check rather than by failed requests
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Raise CircuitOpenError if a request should not be sent right now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            # A trial whose outcome never arrived (e.g. an abandoned stream)
+            # doesn't block the breaker forever
+            if self.state == self.HALF_OPEN and (
+                not self._trial_in_flight or now - self._trial_started >= self.reset_timeout
+            ):
+                self._trial_in_flight = True
+                self._trial_started = now
+                return
+            raise CircuitOpenError("Ollama appears to be unavailable; not sending request")
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._open()
+
+    def trip(self):
+        """Open the breaker immediately, e.g. when a health check fails"""
+        with self._lock:
+            self._open()
+            self._tripped = True
+
+    def recover(self):
+        """A health check succeeded: if a failed check opened the breaker, let a trial request through"""
+        with self._lock:
+            if self.state == self.OPEN and self._tripped:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._tripped = False
+        self._trial_in_flight = False
+
+
+def is_transient_error(error):
+    """Whether a failed Ollama call is worth retrying"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (httpx.TransportError, ConnectionError)):
+        return True
+    if isinstance(error, ollama.ResponseError) and error.status_code in (429, 500, 502, 503, 504):
+        return True
+    return "overloaded" in str(error).lower()
+
+
+class OllamaService:
+    """Shared Ollama client with connection reuse, cached liveness and a circuit breaker.
+
+    One instance is shared by the whole process. Requests go through a single
+    keep-alive HTTP client, a background heartbeat keeps is_alive() cheap,
+    and the circuit breaker makes calls fail fast during an outage instead of
+    piling up behind timeouts.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls, host=None):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super(OllamaService, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self, host=None):
+        if self._initialized:
+            return
+
+        self.host = host
+        self.client = ollama.Client(
+            host=host,
+            timeout=httpx.Timeout(OLLAMA_REQUEST_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_keepalive_connections=OLLAMA_POOL_SIZE, keepalive_expiry=60)
+        )
+        # Health checks get their own client so a long generation can't delay them
+        self._health_client = ollama.Client(host=host, timeout=OLLAMA_HEARTBEAT_TIMEOUT)
+        self.breaker = CircuitBreaker()
+
+        self._alive = None
+        self._models = []
+        self._monitor = None
+        self._stop_monitor = threading.Event()
+        self._listeners = []
+        
+        # Models kept loaded by the warmer thread, and when each was last used
+        self._last_used = {}
+        self._warm_models = set()
+        self._warmer = None
+        self._wake_warmer = threading.Event()
+
+        # Chat requests in progress, so background jobs can stay out of their way
+        self._active_requests = 0
+        self._last_request = None
+        self._activity = threading.Condition()
+
+        self._initialized = True
+
+    def async_client(self):
+        """Create an AsyncClient with the same host and timeouts.
+
+        Async clients are bound to the event loop that uses them, so they
+        can't be shared the way the sync client is.
+        """
+        return ollama.AsyncClient(
+            host=self.host,
+            timeout=httpx.Timeout(OLLAMA_REQUEST_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_keepalive_connections=OLLAMA_POOL_SIZE, keepalive_expiry=60)
+        )
+
+    def ping(self):
+        """Check the server right now and update the cached liveness"""
+        try:
+            self._models = self._health_client.list().get('models', [])
+            alive = True
+        except Exception as e:
+            if self._alive is not False:
+                logger.warning("Ollama health check failed: %s", e)
+            alive = False
+
+        if alive:
+            self.breaker.recover()
+        else:
+            self.breaker.trip()
+        previous, self._alive = self._alive, alive
+        if previous is not None and alive != previous:
+            for listener in list(self._listeners):
+                try:
+                    listener(alive)
+                except Exception as e:
+                    logger.error("Error in Ollama liveness listener: %s", e)
+        return alive
+
+    def add_listener(self, callback):
+        """Call callback(alive) whenever a health check finds the server has gone down or come back"""
+        self._listeners.append(callback)
+
+    def is_alive(self, refresh=False):
+        """Return the cached liveness, checking the server if it's unknown or refresh is set"""
+        if refresh or self._alive is None:
+            return self.ping()
+        return self._alive
+
+    def wait_until_alive(self, timeout=OLLAMA_STARTUP_TIMEOUT, interval=0.5):
+        """Poll the server until it responds or timeout seconds have passed"""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.ping():
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+    def list_models(self, refresh=False):
+        """Return the model list from the most recent health check"""
+        if refresh or self._alive is None:
+            self.ping()
+        return self._models
+
+    def start_monitor(self, interval=OLLAMA_HEARTBEAT_INTERVAL):
+        """Start the background heartbeat that keeps is_alive() current"""
+        if self._monitor is not None:
+            return
+        self._stop_monitor.clear()
+
+        def run():
+            while not self._stop_monitor.is_set():
+                self.ping()
+                self._stop_monitor.wait(interval)
+
+        self._monitor = threading.Thread(target=run, name="ollama-heartbeat", daemon=True)
+        self._monitor.start()
+
+    def stop_monitor(self):
+        if self._monitor is not None:
+            self._stop_monitor.set()
+            self._monitor.join()
+            self._monitor = None
+
+    def warm(self, model_name):
+        """Load model_name into memory with an empty request. Returns the seconds it took."""
+        self.breaker.check()
+        with span("model_load") as timer:
+            try:
+                # An empty prompt makes Ollama load the model without generating anything
+                self.client.generate(model=model_name, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+            except Exception as e:
+                self._record_error(e)
+                raise
+        self.breaker.record_success()
+        self.mark_used(model_name)
+        logger.info("Warmed model %s in %.2fs", model_name, timer.seconds)
+        return timer.seconds
+
+    @contextmanager
+    def in_use(self):
+        """Mark a user-facing request as in progress for the duration of the block"""
+        with self._activity:
+            self._active_requests += 1
+        try:
+            yield
+        finally:
+            with self._activity:
+                self._active_requests -= 1
+                self._last_request = time.monotonic()
+                self._activity.notify_all()
+
+    def wait_idle(self, quiet=0, timeout=None):
+        """Block until no request has been in progress for quiet seconds. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._activity:
+            while True:
+                now = time.monotonic()
+                if self._active_requests:
+                    remaining = None
+                elif self._last_request is None:
+                    return True
+                else:
+                    remaining = self._last_request + quiet - now
+                if remaining is not None and remaining <= 0:
+                    return True
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    remaining = deadline - now if remaining is None else min(remaining, deadline - now)
+                self._activity.wait(remaining)
+
+    def mark_used(self, model_name):
+        """Note that model_name just served a request, so it is loaded"""
+        self._last_used[model_name] = time.monotonic()
+
+    def keep_warm(self, model_name, idle_interval=MODEL_REWARM_INTERVAL):
+        """Re-warm model_name in the background after idle_interval seconds without
+        use, and whenever the server comes back after being down.
+
+        A restarted server has unloaded every model, so the next request would
+        otherwise pay the full load time.
+        """
+        self._warm_models.add(model_name)
+        if self._warmer is not None:
+            self._wake_warmer.set()
+            return
+        
+        def on_change(alive):
+            if alive:
+                for name in self._warm_models:
+                    self._last_used.pop(name, None)
+                self._wake_warmer.set()
+        
+        def run():
+            while True:
+                waits = [self._warm_if_due(name, idle_interval) for name in list(self._warm_models)]
+                waits = [wait for wait in waits if wait is not None]
+                self._wake_warmer.wait(min(waits) if waits else None)
+                self._wake_warmer.clear()
+        
+        self.add_listener(on_change)
+        self._warmer = threading.Thread(target=run, name="ollama-warmer", daemon=True)
+        self._warmer.start()
+
+    def _warm_if_due(self, model_name, idle_interval):
+        """Warm model_name if it hasn't been used recently; returns seconds until the next check"""
+        last_used = self._last_used.get(model_name)
+        if last_used is not None:
+            if idle_interval is None:
+                return None
+            remaining = last_used + idle_interval - time.monotonic()
+            if remaining > 0:
+                return remaining
+        if self._alive is False:
+            return None  # Warmed when the server comes back
+        try:
+            self.warm(model_name)
+        except Exception as e:
+            logger.warning("Error warming model %s: %s", model_name, e)
+            return OLLAMA_BREAKER_RESET_TIMEOUT
+        return idle_interval
+
+    def chat(self, **kwargs):
+        """Call ollama chat through the shared client, guarded by the circuit breaker.
+
+        With stream=True the returned iterator reports to the breaker as it
+        is consumed.
+        """
+        self.breaker.check()
+        kwargs.setdefault('keep_alive', OLLAMA_KEEP_ALIVE)
+        try:
+            response = self.client.chat(**kwargs)
+        except Exception as e:
+            self._record_error(e)
+            raise
+
+        self.mark_used(kwargs.get('model'))
+        if kwargs.get('stream'):
+            return self._guard_stream(response)
+        self.breaker.record_success()
+        return response
+
+    def pull(self, model_name):
+        self.breaker.check()
+        try:
+            result = self.client.pull(model_name)
+        except Exception as e:
+            self._record_error(e)
+            raise
+        self.breaker.record_success()
+        return result
+
+    def _guard_stream(self, response):
+        try:
+            for part in response:
+                yield part
+        except Exception as e:
+            self._record_error(e)
+            raise
+        self.breaker.record_success()
+
+    def _record_error(self, error):
+        # Errors about the request itself (bad model name, ...) say nothing
+        # about the server's health
+        if is_transient_error(error):
+            self.breaker.record_failure()
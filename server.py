@@ -0,0 +1,244 @@
+"""Headless multi-session chat server.
+
+Serves many conversations from one process, all sharing the VectorStore
+singleton. Each session gets its own AsyncChatInterface, so session state is
+isolated while the Ollama client and the database are shared.
+
+Endpoints:
+    POST   /sessions                   start a session -> {"session_id": ...}
+    DELETE /sessions/{id}              end a session
+    POST   /sessions/{id}/chat         {"message": ..., "stream": bool}
+                                       -> JSON reply, or Server-Sent Events if stream
+    GET    /sessions/{id}/history      stored messages for the session
+    GET    /sessions/{id}/ws           WebSocket: send {"message": ...},
+                                       receive {"chunk": ...} then {"done": true}
+    GET    /health
+    GET    /metrics                    Prometheus text; ?format=json for JSON
+
+Run with:
+    python server.py --port 8080 [--ollama-host http://localhost:11434]
+"""
+
+from aiohttp import web
+from chat_interface import AsyncChatInterface
+from vector_store import VectorStore
+from chunking import merge_chunks
+from compaction import CompactionJob
+import argparse
+import asyncio
+import json
+import metrics
+import time
+from ollama_service import OllamaService
+from config import *
+
+
+class SessionRegistry:
+    """Live chat sessions keyed by session ID, expired after a period of inactivity"""
+
+    def __init__(self, client, model_name=DEFAULT_MODEL, max_sessions=SERVER_MAX_SESSIONS,
+                 idle_timeout=SERVER_SESSION_IDLE_TIMEOUT):
+        self.client = client
+        self.model_name = model_name
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = {}  # session_id -> (chat, lock, last_used)
+
+    def create(self):
+        """Start a new session and return its chat interface"""
+        self.expire_idle()
+        if len(self._sessions) >= self.max_sessions:
+            raise web.HTTPServiceUnavailable(reason="Too many active sessions")
+        chat = AsyncChatInterface(self.model_name, client=self.client)
+        self._sessions[chat.session_id] = (chat, asyncio.Lock(), time.monotonic())
+        return chat
+
+    def get(self, session_id):
+        """Return (chat, lock) for a live session, or raise 404"""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            raise web.HTTPNotFound(reason="Unknown session")
+        chat, lock, _ = entry
+        self._sessions[session_id] = (chat, lock, time.monotonic())
+        return chat, lock
+
+    def remove(self, session_id):
+        if self._sessions.pop(session_id, None) is None:
+            raise web.HTTPNotFound(reason="Unknown session")
+
+    def expire_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for session_id, (_, lock, last_used) in list(self._sessions.items()):
+            if last_used < cutoff and not lock.locked():
+                del self._sessions[session_id]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+async def _read_message(request):
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(reason="Body must be JSON")
+    message = str(body.get("message", "")).strip()
+    if not message:
+        raise web.HTTPBadRequest(reason="Missing message")
+    return message, bool(body.get("stream", False))
+
+
+async def create_session(request):
+    chat = request.app["sessions"].create()
+    return web.json_response({"session_id": chat.session_id}, status=201)
+
+
+async def delete_session(request):
+    request.app["sessions"].remove(request.match_info["session_id"])
+    return web.Response(status=204)
+
+
+async def send_message(request):
+    chat, lock = request.app["sessions"].get(request.match_info["session_id"])
+    message, stream = await _read_message(request)
+
+    # Turns within a session run one at a time; different sessions run concurrently
+    async with lock:
+        if not stream:
+            return web.json_response({"response": await chat.chat(message)})
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        })
+        await response.prepare(request)
+        async for chunk in chat.chat_stream(message):
+            await response.write(f"data: {json.dumps({'chunk': chunk})}\n\n".encode("utf-8"))
+        await response.write(b"event: done\ndata: {}\n\n")
+        await response.write_eof()
+        return response
+
+
+async def chat_websocket(request):
+    chat, lock = request.app["sessions"].get(request.match_info["session_id"])
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    async for msg in ws:
+        if msg.type != web.WSMsgType.TEXT:
+            continue
+        try:
+            message = str(json.loads(msg.data).get("message", "")).strip()
+        except (json.JSONDecodeError, AttributeError):
+            message = ""
+        if not message:
+            await ws.send_json({"error": "Missing message"})
+            continue
+
+        async with lock:
+            async for chunk in chat.chat_stream(message):
+                await ws.send_json({"chunk": chunk})
+        await ws.send_json({"done": True})
+
+    return ws
+
+
+async def get_history(request):
+    session_id = request.match_info["session_id"]
+    request.app["sessions"].get(session_id)
+    try:
+        limit = int(request.query.get("limit", 100))
+    except ValueError:
+        raise web.HTTPBadRequest(reason="limit must be an integer")
+    if limit < 1:
+        raise web.HTTPBadRequest(reason="limit must be positive")
+    store = request.app["store"]
+
+    def load():
+        # Make queued turns visible before reading them back
+        store.flush()
+        records = merge_chunks(store.iter_records(where={"session": session_id}))
+        # A user message and its reply share a timestamp, so put the user first
+        records.sort(key=lambda r: (r['metadata'].get('created_at', 0), r['metadata'].get('role') != 'user'))
+        return records[-limit:]
+
+    records = await asyncio.get_running_loop().run_in_executor(None, load)
+    return web.json_response({"session_id": session_id, "messages": [
+        {
+            "id": record['id'],
+            "role": record['metadata'].get('role'),
+            "timestamp": record['metadata'].get('timestamp'),
+            "content": record['document'],
+        }
+        for record in records
+    ]})
+
+
+async def health(request):
+    service = OllamaService()
+    return web.json_response({
+        "status": "ok",
+        "sessions": len(request.app["sessions"]),
+        "ollama_alive": service.is_alive(),
+        "ollama_breaker": service.breaker.state,
+    })
+
+
+async def get_metrics(request):
+    if request.query.get("format") == "json":
+        return web.Response(text=metrics.to_json(), content_type="application/json")
+    return web.Response(text=metrics.to_prometheus(), content_type="text/plain")
+
+
+def create_app(ollama_host=None, model_name=DEFAULT_MODEL):
+    """Build the aiohttp application"""
+    service = OllamaService(ollama_host)
+    sessions = SessionRegistry(service.async_client(), model_name)
+
+    app = web.Application()
+    app["sessions"] = sessions
+
+    async def on_startup(app):
+        # Loading the store is slow and blocking, so do it once before serving
+        app["store"] = await asyncio.get_running_loop().run_in_executor(None, VectorStore)
+        service.start_monitor()
+        if MODEL_WARMUP:
+            # Loads the model in the background and keeps it loaded
+            service.keep_warm(model_name)
+        if COMPACTION_ENABLED:
+            app["compaction"] = CompactionJob()
+            app["compaction"].start()
+
+    async def on_cleanup(app):
+        if "compaction" in app:
+            app["compaction"].stop()
+        service.stop_monitor()
+        app["store"].close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.add_routes([
+        web.post("/sessions", create_session),
+        web.delete("/sessions/{session_id}", delete_session),
+        web.post("/sessions/{session_id}/chat", send_message),
+        web.get("/sessions/{session_id}/history", get_history),
+        web.get("/sessions/{session_id}/ws", chat_websocket),
+        web.get("/health", health),
+        web.get("/metrics", get_metrics),
+    ])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the persistent chat over HTTP")
+    parser.add_argument("--host", default=SERVER_HOST, help=f"Address to bind (default: {SERVER_HOST})")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help=f"Port to bind (default: {SERVER_PORT})")
+    parser.add_argument("--ollama-host", default=None,
+                        help="Ollama server URL (default: $OLLAMA_HOST or http://localhost:11434)")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help=f"Model to chat with (default: {DEFAULT_MODEL})")
+    args = parser.parse_args()
+
+    web.run_app(create_app(args.ollama_host, args.model), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""Time-partitioned storage for the chat history collection.
+
+ShardedCollection stands in for a single Chroma collection. Entries are
+written to one collection per period (e.g. chat_history_2025_03 for March
+2025) chosen by their created_at, searches run on the shards overlapping the
+created_at window of their where filter in parallel, and the per-shard top
+results are merged by distance. A collection from before sharding was turned
+on is kept as a legacy shard that every search includes.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import re
+import threading
+import time
+
+# strftime pattern of each period's shard key
+SHARD_PERIODS = {"month": "%Y_%m", "year": "%Y"}
+
+
+def _created_at(metadata):
+    created = metadata.get("created_at")
+    if created is None and metadata.get("timestamp"):
+        try:
+            created = datetime.fromisoformat(metadata["timestamp"]).timestamp()
+        except ValueError:
+            pass
+    return time.time() if created is None else created
+
+
+def shard_bounds(key):
+    """[start, end) of a shard key in epoch seconds (UTC)"""
+    if "_" in key:
+        year, month = map(int, key.split("_"))
+        start = datetime(year, month, 1, tzinfo=timezone.utc)
+        end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    else:
+        start = datetime(int(key), 1, 1, tzinfo=timezone.utc)
+        end = datetime(int(key) + 1, 1, 1, tzinfo=timezone.utc)
+    return start.timestamp(), end.timestamp()
+
+
+def time_window(where):
+    """The (since, until) bounds a where filter puts on created_at; None where unbounded"""
+    since = until = None
+    conditions = where.get("$and", [where]) if where else []
+    for condition in conditions:
+        bounds = condition.get("created_at")
+        if isinstance(bounds, dict):
+            since = bounds.get("$gte", bounds.get("$gt", since))
+            until = bounds.get("$lt", bounds.get("$lte", until))
+    return since, until
+
+
+class ShardedCollection:
+    """The parts of the Chroma collection API VectorStore uses, spread over time shards"""
+
+    def __init__(self, client, name, metadata, embedding_function, period="month", workers=4):
+        if period not in SHARD_PERIODS:
+            raise ValueError(f"Unknown shard period {period!r}; expected one of {', '.join(SHARD_PERIODS)}")
+        self.client = client
+        self.name = name
+        self.period = period
+        self._metadata = metadata
+        self._embedding_function = embedding_function
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard-query")
+        self._shards = {}
+        self._legacy = None
+
+        pattern = re.compile(rf"^{re.escape(name)}_(\d{{4}}(?:_\d{{2}})?)$")
+        for collection in client.list_collections():
+            match = pattern.match(collection.name)
+            if match:
+                self._shards[match.group(1)] = self._open(collection.name)
+            elif collection.name == name:
+                self._legacy = self._open(name)
+
+    def _open(self, name):
+        return self.client.get_or_create_collection(
+            name=name, metadata=self._metadata, embedding_function=self._embedding_function
+        )
+
+    @property
+    def metadata(self):
+        collections = self.collections()
+        return collections[0].metadata if collections else None
+
+    def shard_key(self, metadata):
+        return datetime.fromtimestamp(_created_at(metadata), timezone.utc).strftime(SHARD_PERIODS[self.period])
+
+    def shards(self):
+        """Shard keys, oldest first"""
+        with self._lock:
+            return sorted(self._shards)
+
+    def collections(self, since=None, until=None):
+        """The legacy collection, if any, then the shards overlapping [since, until), oldest first"""
+        with self._lock:
+            shards = sorted(self._shards.items())
+            selected = [self._legacy] if self._legacy is not None else []
+        for key, collection in shards:
+            start, end = shard_bounds(key)
+            if (since is None or end > since) and (until is None or start < until):
+                selected.append(collection)
+        return selected
+
+    def keyed_collections(self):
+        """(shard key, collection) pairs, oldest first; the legacy collection's key is empty"""
+        with self._lock:
+            pairs = sorted(self._shards.items())
+            if self._legacy is not None:
+                pairs.insert(0, ("", self._legacy))
+        return pairs
+
+    def _shard(self, key):
+        with self._lock:
+            if key not in self._shards:
+                self._shards[key] = self._open(f"{self.name}_{key}")
+            return self._shards[key]
+
+    def _group(self, ids, metadatas, *columns):
+        """Split parallel write arguments by the shard their metadata belongs in"""
+        groups = {}
+        for row in zip(ids, metadatas, *columns):
+            groups.setdefault(self.shard_key(row[1]), []).append(row)
+        return {key: [list(column) for column in zip(*rows)] for key, rows in groups.items()}
+
+    def add(self, ids, documents, embeddings, metadatas):
+        for key, (ids_, metadatas_, documents_, embeddings_) in self._group(
+                ids, metadatas, documents, embeddings).items():
+            self._shard(key).add(ids=ids_, documents=documents_, embeddings=embeddings_, metadatas=metadatas_)
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        for key, (ids_, metadatas_, documents_, embeddings_) in self._group(
+                ids, metadatas, documents, embeddings).items():
+            self._shard(key).upsert(ids=ids_, documents=documents_, embeddings=embeddings_, metadatas=metadatas_)
+
+    def _locate(self, ids):
+        """Pairs of (collection, ids stored in it)"""
+        located = []
+        for collection in self.collections():
+            found = collection.get(ids=list(ids), include=[])['ids']
+            if found:
+                located.append((collection, found))
+        return located
+
+    def update(self, ids, metadatas):
+        by_id = dict(zip(ids, metadatas))
+        for collection, found in self._locate(ids):
+            collection.update(ids=found, metadatas=[by_id[id_] for id_ in found])
+
+    def delete(self, ids):
+        if not ids:
+            return
+        for collection, found in self._locate(ids):
+            collection.delete(ids=found)
+
+    def count(self):
+        return sum(collection.count() for collection in self.collections())
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("metadatas", "documents")):
+        """Entries from every shard, concatenated oldest shard first.
+
+        limit and offset apply to the concatenation, so every match is read;
+        scan large stores one collection at a time through collections().
+        """
+        if ids is not None and not ids:
+            return {"ids": [], **{field: [] for field in include}}
+        since, until = time_window(where)
+        merged = {"ids": [], **{field: [] for field in include}}
+        for collection in self.collections(since, until):
+            result = collection.get(ids=ids, where=where, include=list(include))
+            merged["ids"].extend(result["ids"])
+            for field in include:
+                merged[field].extend(result[field])
+        start = offset or 0
+        end = None if limit is None else start + limit
+        return {field: values[start:end] for field, values in merged.items()}
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "documents", "distances")):
+        """Search the shards overlapping the where filter's time window and keep the n_results closest"""
+        include = list(include)
+        if "distances" not in include:
+            include.append("distances")
+        since, until = time_window(where)
+        sizes = [(collection, collection.count()) for collection in self.collections(since, until)]
+        collections = [(collection, size) for collection, size in sizes if size]
+
+        def search(item):
+            collection, size = item
+            # Chroma warns when asked for more results than a shard holds
+            return collection.query(
+                query_embeddings=query_embeddings,
+                n_results=min(n_results, size),
+                where=where,
+                include=include
+            )
+
+        if len(collections) > 1:
+            results = list(self._executor.map(search, collections))
+        else:
+            results = [search(item) for item in collections]
+
+        fields = ["ids"] + include
+        merged = {field: [] for field in fields}
+        for i in range(len(query_embeddings)):
+            rows = [
+                tuple(result[field][i][j] for field in fields)
+                for result in results
+                for j in range(len(result["ids"][i]))
+            ]
+            rows.sort(key=lambda row: row[fields.index("distances")])
+            rows = rows[:n_results]
+            for index, field in enumerate(fields):
+                merged[field].append([row[index] for row in rows])
+        return merged
+
+    def drop_shard(self, key):
+        """Delete a whole shard and return how many entries it held"""
+        with self._lock:
+            collection = self._shards.pop(key)
+        count = collection.count()
+        self.client.delete_collection(collection.name)
+        return count
+
+    def drop_all(self):
+        """Delete every shard and the legacy collection"""
+        for key in self.shards():
+            self.drop_shard(key)
+        with self._lock:
+            legacy, self._legacy = self._legacy, None
+        if legacy is not None:
+            self.client.delete_collection(legacy.name)
@@ -0,0 +1,84 @@
+import threading
+import time
+
+
+class DependencyError(RuntimeError):
+    """A startup task was skipped because a task it depends on failed"""
+
+
+class StartupPipeline:
+    """Runs startup tasks concurrently, each as soon as the tasks it depends on finish.
+
+    Tasks are added with their dependencies and started together by start().
+    A task whose dependency failed is not run and fails too. Every task's
+    outcome and duration is reported to on_event(name, error, seconds), from
+    the task's own thread; error is None on success.
+    """
+
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self.timings = {}
+        self._tasks = {}
+        self._results = {}
+        self._errors = {}
+        self._done = {}
+        self._started_at = None
+
+    def add(self, name, func, depends_on=()):
+        """Register func to run once every task named in depends_on has succeeded"""
+        unknown = [dep for dep in depends_on if dep not in self._tasks]
+        if unknown:
+            raise ValueError(f"Task {name} depends on unknown tasks: {', '.join(unknown)}")
+        self._tasks[name] = (func, tuple(depends_on))
+        self._done[name] = threading.Event()
+
+    def start(self):
+        """Start every task on its own thread and return immediately"""
+        self._started_at = time.perf_counter()
+        for name in self._tasks:
+            threading.Thread(target=self._run, args=(name,), name=f"startup-{name}", daemon=True).start()
+
+    def _run(self, name):
+        func, depends_on = self._tasks[name]
+        error = None
+        try:
+            for dep in depends_on:
+                self._done[dep].wait()
+                if dep in self._errors:
+                    raise DependencyError(f"{dep} failed")
+            start = time.perf_counter()
+            try:
+                self._results[name] = func()
+            finally:
+                self.timings[name] = time.perf_counter() - start
+        except Exception as e:
+            error = e
+            self._errors[name] = e
+        # Reported before the task counts as done, so dependents' reports come after
+        try:
+            if self.on_event:
+                self.on_event(name, error, self.timings.get(name, 0.0))
+        finally:
+            self._done[name].set()
+
+    def wait(self, name, timeout=None):
+        """Block until task name has finished and return its result, re-raising its error"""
+        if not self._done[name].wait(timeout):
+            raise TimeoutError(f"Startup task {name} did not finish in time")
+        if name in self._errors:
+            raise self._errors[name]
+        return self._results.get(name)
+
+    def done(self, name):
+        return self._done[name].is_set() and name not in self._errors
+
+    def elapsed(self):
+        """Seconds since start()"""
+        return time.perf_counter() - self._started_at
+
+    def summary(self):
+        """One line listing each task's duration, e.g. "ollama 0.12s, store 2.31s" """
+        return ", ".join(
+            f"{name} {self.timings[name]:.2f}s" + (" (failed)" if name in self._errors else "")
+            for name in self._tasks if name in self.timings
+        )
@@ -0,0 +1,104 @@
+"""Minimal stand-in for the Ollama HTTP API, for exercising the app without a model.
+
+Answers /api/chat (streaming or not), /api/generate, /api/tags and
+/api/version with canned replies that echo the last user message.
+Like Ollama, it remembers the last conversation per model and reports only
+the prompt tokens after the part shared with it as prompt_eval_count.
+
+Run with:
+    python stub_ollama.py --port 11435
+and point the app at it, e.g. python server.py --ollama-host http://127.0.0.1:11435
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import time
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    reply_delay = 0.01  # Seconds between streamed chunks
+    _cached_prompts = {}  # Model -> last prompt plus reply, standing in for the KV cache
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-stub"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": "qwq:latest"}]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json({"error": "not found"}, status=404)
+            return
+
+        if self.path == "/api/chat":
+            messages = request.get("messages") or []
+            prompt = messages[-1]["content"] if messages else ""
+        else:
+            prompt = request.get("prompt", "")
+        reply = f"Stub reply to: {prompt[-200:]}"
+        words = [word + " " for word in reply.split()]
+        model = request.get("model", "")
+        text = "".join(f"{m.get('role')}:{m.get('content', '')}\n" for m in request.get("messages", []))
+        cached = os.path.commonprefix([self._cached_prompts.get(model, ""), text])
+        prompt_tokens = max(1, (len(text) - len(cached)) // 4)
+        if self.path == "/api/chat":
+            self._cached_prompts[model] = text + f"assistant:{''.join(words)}\n"
+
+        def part(content, done):
+            key = "message" if self.path == "/api/chat" else "response"
+            value = {"role": "assistant", "content": content} if key == "message" else content
+            payload = {"model": request.get("model", ""), key: value, "done": done}
+            if done:
+                payload.update({"prompt_eval_count": prompt_tokens, "eval_count": len(words)})
+            return payload
+
+        if not request.get("stream", True):
+            self._send_json(part("".join(words), True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(words + [""]):
+            line = json.dumps(part(word, i == len(words))).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+            time.sleep(self.reply_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stub Ollama API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), StubOllamaHandler)
+    print(f"Stub Ollama listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
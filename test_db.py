@@ -5,7 +5,7 @@ from config import DEBUG_PRINTS
 def test_db():
     try:
         # Get VectorStore instance
-        store = VectorStore.get_instance()
+        store = VectorStore()
         
         # Test writing
         print("\nTesting write...")
@@ -1,28 +1,414 @@
 import chromadb
 import uuid
+from chunking import chunk_id, merge_chunks, split_text
+from context_packer import estimate_tokens
+from embeddings import create_embedding_function
+from lexical_index import BM25Index, tokenize
+from logs import get_logger
+from sharding import ShardedCollection, time_window
+from metrics import counter, span
+from collections import OrderedDict
 from datetime import datetime
+import atexit
+import hashlib
+import numpy
 import os
+import queue
+import sqlite3
+import threading
+import time
 from config import *
 
+logger = get_logger(__name__)
+
+EMBEDDING_CACHE_REQUESTS = counter("embedding_cache_requests_total", "Texts looked up in the embedding cache, by result")
+QUERY_CACHE_REQUESTS = counter("query_cache_requests_total", "Searches looked up in the query cache, by result")
+ENTRIES_WRITTEN = counter("vector_store_entries_written_total", "Entries (chunks) written to the collection")
+WRITES_DROPPED = counter("vector_store_writes_dropped_total", "Queued entries (chunks) dropped after every write attempt failed")
+DUPLICATES_MERGED = counter("vector_store_duplicates_merged_total", "Entries (chunks) not written because they were already stored")
+
+
+def content_id(content, role=None, session=None):
+    """ID a message is stored under with DEDUPLICATE: a hash of its session, role and whitespace-normalized text.
+
+    The session is part of it so that every entry belongs to one session,
+    and session history and compaction see all of a session's turns.
+    """
+    key = f"{session or ''}\n{role or ''}\n{' '.join(content.split())}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def metadata_filter(**fields):
+    """Chroma where filter matching every field given a value, or None"""
+    conditions = [{key: value} for key, value in fields.items() if value]
+    if len(conditions) > 1:
+        return {"$and": conditions}
+    return conditions[0] if conditions else None
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used cache"""
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+    
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+    
+    def items(self):
+        """Return a snapshot of the cached items, oldest first"""
+        with self._lock:
+            return list(self._items.items())
+    
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+    
+    def __len__(self):
+        return len(self._items)
+
+
+class QueryCache:
+    """LRU cache of search results that is kept consistent with writes.
+
+    Each entry remembers the query embedding and the distance a new entry has
+    to beat to appear in its results, so a write only evicts the cached
+    queries it could actually change.
+    """
+    
+    def __init__(self, max_size):
+        self._entries = LRUCache(max_size)
+        self._lock = threading.Lock()
+        self._generation = 0  # Bumped on every write so in-flight searches aren't cached stale
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    @staticmethod
+    def make_key(query_text, n_results, threshold, since=None, until=None):
+        normalized = " ".join(query_text.lower().split())
+        return (normalized, n_results, threshold, since, until)
+    
+    def get(self, key):
+        """Return cached records for key, or None along with the current generation"""
+        entry = self._entries.get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None, self._generation
+            self.hits += 1
+            return list(entry[0]), self._generation
+    
+    def put(self, key, records, query_embedding, cutoff, terms, generation):
+        query_vector = numpy.asarray(query_embedding, dtype=float)
+        query_vector = query_vector / (numpy.linalg.norm(query_vector) or 1.0)
+        entry = (list(records), query_vector, cutoff, frozenset(terms))
+        # Checked and stored under one lock, so a write can't slip in between
+        # and leave a result from before it cached
+        with self._lock:
+            if generation == self._generation:
+                self._entries.put(key, entry)
+    
+    def invalidate(self, embeddings, documents):
+        """Drop cached queries whose results the newly added entries could change"""
+        vectors = numpy.asarray(embeddings, dtype=float)
+        new_terms = set()
+        if len(vectors):
+            vectors = vectors / numpy.maximum(numpy.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            for document in documents:
+                new_terms.update(tokenize(document))
+        with self._lock:
+            self._generation += 1
+            if not len(vectors):
+                return
+            for key, (_, query_vector, cutoff, terms) in self._entries.items():
+                distances = 1.0 - vectors @ query_vector
+                if distances.min() < cutoff or not terms.isdisjoint(new_terms):
+                    self._entries.pop(key)
+                    self.invalidations += 1
+    
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+            }
+
+
+class ChangeLog:
+    """Sidecar SQLite table of written entry IDs, indexed by the time they were logged.
+
+    Chroma doesn't index metadata values, so "what changed since X" is answered
+    from here and only the matching entries are fetched from the collection.
+    Rows are tagged with the entry's time shard, so dropping a shard is one
+    DELETE.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS changes ("
+                "id TEXT PRIMARY KEY, logged_at REAL NOT NULL, shard TEXT NOT NULL DEFAULT '')"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(changes)")]
+            if "shard" not in columns:
+                self._conn.execute("ALTER TABLE changes ADD COLUMN shard TEXT NOT NULL DEFAULT ''")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS changes_logged_at ON changes (logged_at)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS changes_shard ON changes (shard)"
+            )
+    
+    def record(self, ids, shards=None):
+        """Log ids as written now; shards gives each entry's time shard key (None = unsharded)"""
+        with self._lock, self._conn:
+            logged_at = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO changes (id, logged_at, shard) VALUES (?, ?, ?)",
+                [(id_, logged_at, shard) for id_, shard in zip(ids, shards or [""] * len(ids))]
+            )
+    
+    def since(self, watermark, limit=None):
+        """Return (id, logged_at) pairs logged after watermark, oldest first.
+
+        With a limit, entries sharing the last returned timestamp are all
+        included so the next call can safely continue from it.
+        """
+        with self._lock:
+            upper = None
+            if limit is not None:
+                row = self._conn.execute(
+                    "SELECT logged_at FROM changes WHERE logged_at > ? "
+                    "ORDER BY logged_at LIMIT 1 OFFSET ?",
+                    (watermark, limit - 1)
+                ).fetchone()
+                upper = row[0] if row else None
+            if upper is None:
+                return self._conn.execute(
+                    "SELECT id, logged_at FROM changes WHERE logged_at > ? ORDER BY logged_at",
+                    (watermark,)
+                ).fetchall()
+            return self._conn.execute(
+                "SELECT id, logged_at FROM changes WHERE logged_at > ? AND logged_at <= ? "
+                "ORDER BY logged_at",
+                (watermark, upper)
+            ).fetchall()
+    
+    def remove(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM changes WHERE id = ?", [(id_,) for id_ in ids])
+    
+    def drop_shard(self, shard):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM changes WHERE shard = ?", (shard,))
+    
+    def latest(self, n):
+        """Return the n most recently logged (id, logged_at) pairs, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, logged_at FROM changes ORDER BY logged_at DESC LIMIT ?",
+                (n,)
+            ).fetchall()
+        return rows[::-1]
+    
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM changes")
+
+
+class WriteBehindQueue:
+    """Background writer that merges pending entries into batched collection.add calls.
+
+    A batch that fails to write (e.g. "database is locked" while another
+    tool holds the SQLite file) is kept and retried with exponential
+    backoff, and at the latest on the next flush or close. After
+    WRITE_RETRIES failed attempts its entries are dropped, counted in
+    vector_store_writes_dropped_total and reported by the next flush().
+    """
+    
+    _FLUSH = object()  # Marker asking the writer to flush immediately
+    _STOP = object()   # Marker asking the writer to flush and exit
+    
+    def __init__(self, store, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL,
+                 retries=WRITE_RETRIES, retry_backoff=WRITE_RETRY_BACKOFF):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue()
+        self._closed = False
+        self._failed = []   # [batch, attempts, retry_at] of writes awaiting a retry
+        self._dropped = 0   # Entries given up on since take_dropped() was last called
+        self._dropped_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="vector-store-writer", daemon=True)
+        self._thread.start()
+    
+    def put(self, contents, metadatas, ids):
+        """Queue entries for writing"""
+        if self._closed:
+            raise RuntimeError("Write-behind queue is closed")
+        for entry in zip(contents, metadatas, ids):
+            self._queue.put(entry)
+    
+    def flush(self):
+        """Block until everything queued so far has been written.
+
+        Failed writes are retried first; raises RuntimeError if any entries
+        had to be dropped since the last flush.
+        """
+        if self._closed:
+            return
+        self._queue.put(self._FLUSH)
+        self._queue.join()
+        dropped = self.take_dropped()
+        if dropped:
+            raise RuntimeError(f"{dropped} queued entries could not be written to the vector store")
+    
+    def close(self):
+        """Write out any pending entries and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join()
+    
+    def take_dropped(self):
+        """Return the number of entries dropped since the last call and reset it"""
+        with self._dropped_lock:
+            dropped, self._dropped = self._dropped, 0
+        return dropped
+    
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            wake_times = [t for t in [deadline] + [retry_at for _, _, retry_at in self._failed] if t is not None]
+            timeout = None if not wake_times else max(0, min(wake_times) - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    # Flush interval elapsed
+                    self._write(batch)
+                    batch, deadline = [], None
+                self._retry()
+                continue
+            
+            if item is self._FLUSH or item is self._STOP:
+                self._write(batch)
+                batch, deadline = [], None
+                self._retry(wait=True)
+                self._queue.task_done()
+                if item is self._STOP:
+                    return
+                continue
+            
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch, deadline = [], None
+            elif deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+    
+    def _write(self, batch, attempts=0):
+        """Write a batch; a failure is kept for a retry until the attempts run out"""
+        if not batch:
+            return
+        contents, metadatas, ids = zip(*batch)
+        try:
+            self.store._add_batch(list(contents), list(metadatas), list(ids))
+        except Exception as e:
+            attempts += 1
+            if attempts < self.retries:
+                delay = self.retry_backoff * 2 ** (attempts - 1)
+                logger.warning("Error writing %d queued entries to vector store (attempt %d of %d), "
+                               "retrying in %.1fs: %s", len(batch), attempts, self.retries, delay, e)
+                self._failed.append([batch, attempts, time.monotonic() + delay])
+                return
+            logger.error("Dropping %d queued entries after %d failed writes to vector store: %s",
+                         len(batch), attempts, e)
+            WRITES_DROPPED.inc(len(batch))
+            with self._dropped_lock:
+                self._dropped += len(batch)
+        # Entries count as done once written or dropped, so flush() waits on retries
+        for _ in batch:
+            self._queue.task_done()
+    
+    def _retry(self, wait=False):
+        """Retry failed batches whose backoff has passed; with wait, all of them until resolved"""
+        while self._failed:
+            now = time.monotonic()
+            due = [entry for entry in self._failed if entry[2] <= now]
+            if not due:
+                if not wait:
+                    return
+                time.sleep(min(entry[2] for entry in self._failed) - now)
+                continue
+            for entry in due:
+                self._failed.remove(entry)
+                batch, attempts, _ = entry
+                self._write(batch, attempts)
+
 class VectorStore:
+    """The chat history database.
+
+    VectorStore() returns the one shared store in DB_DIRECTORY. Passing a
+    persist_directory creates a separate store there instead, e.g. for
+    benchmarks, optionally with its own embedding function.
+    """
     _instance = None
     
-    def __new__(cls):
+    def __new__(cls, persist_directory=None, embedding_function=None):
+        if persist_directory is not None:
+            instance = super(VectorStore, cls).__new__(cls)
+            instance._initialized = False
+            return instance
         if cls._instance is None:
             cls._instance = super(VectorStore, cls).__new__(cls)
             cls._instance._initialized = False
         return cls._instance
     
-    def __init__(self):
+    def __init__(self, persist_directory=None, embedding_function=None):
         if self._initialized:
             return
             
         # Use config settings for database setup
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.persist_directory = os.path.join(current_dir, DB_DIRECTORY)
+        if persist_directory is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            persist_directory = os.path.join(current_dir, DB_DIRECTORY)
+        self.persist_directory = persist_directory
             
-        if DEBUG_PRINTS:
-            print(f"\nUsing VectorStore directory: {self.persist_directory}")
+        logger.debug("Using VectorStore directory: %s", self.persist_directory)
             
         # Ensure the directory exists
         os.makedirs(self.persist_directory, exist_ok=True)
@@ -31,113 +417,692 @@ class VectorStore:
             path=self.persist_directory
         )
         
-        if DEBUG_PRINTS:
-            print("ChromaDB client initialized")
+        logger.debug("ChromaDB client initialized")
+        
+        # Embeddings are computed here rather than by Chroma so that each text
+        # is only encoded once, e.g. a user message that was just queried
+        self.embedding_function = embedding_function or create_embedding_function()
+        self._embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE)
+        self._query_cache = QueryCache(QUERY_CACHE_SIZE)
+        self.change_log = ChangeLog(os.path.join(self.persist_directory, CHANGE_LOG_FILE))
+        self.lexical_index = BM25Index(os.path.join(self.persist_directory, LEXICAL_INDEX_FILE))
+        
+        self.collection = self._open_collection()
+        stored_model = (self.collection.metadata or {}).get("embedding_model")
+        if stored_model and stored_model != self.embedding_function.model_name:
+            logger.warning("Collection was embedded with %s but %s is configured; search results "
+                           "will be poor until it is re-embedded", stored_model, self.embedding_function.model_name)
+        
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._archive_collection = None
         
+        # Stores created before the lexical index existed are indexed once
+        if HYBRID_SEARCH and not len(self.lexical_index) and self.collection.count():
+            self.rebuild_lexical_index()
+        
+        self._initialized = True
+
+    def _open_collection(self):
+        """The chat history collection, or with SHARD_BY its time shards behind one interface"""
+        metadata = {"hnsw:space": "cosine", "embedding_model": self.embedding_function.model_name}
+        if SHARD_BY:
+            collection = ShardedCollection(self.client, COLLECTION_NAME, metadata, self.embedding_function,
+                                           period=SHARD_BY, workers=SHARD_QUERY_WORKERS)
+            logger.debug("Using %s shards of '%s': %s", SHARD_BY, COLLECTION_NAME,
+                         ", ".join(collection.shards()) or "none yet")
+            return collection
         try:
             # Try to get existing collection
-            self.collection = self.client.get_collection(name=COLLECTION_NAME)
-            if DEBUG_PRINTS:
-                print(f"Found existing collection '{COLLECTION_NAME}'")
+            collection = self.client.get_collection(
+                name=COLLECTION_NAME,
+                embedding_function=self.embedding_function
+            )
+            logger.debug("Found existing collection '%s'", COLLECTION_NAME)
         except ValueError:
             # Create new collection if it doesn't exist
-            if DEBUG_PRINTS:
-                print(f"Creating new collection '{COLLECTION_NAME}'")
-            self.collection = self.client.create_collection(
+            logger.debug("Creating new collection '%s'", COLLECTION_NAME)
+            collection = self.client.create_collection(
                 name=COLLECTION_NAME,
-                metadata={"hnsw:space": "cosine"}
+                metadata=metadata,
+                embedding_function=self.embedding_function
             )
-        
-        self._initialized = True
+        return collection
+
+    def _shard_keys(self, metadatas):
+        """Time shard key of each entry, for tagging the indexes kept beside the collection"""
+        if isinstance(self.collection, ShardedCollection):
+            return [self.collection.shard_key(metadata) for metadata in metadatas]
+        return None
 
     def add_text(self, content, metadata):
         """Add a text entry to the vector store"""
-        message_id = str(uuid.uuid4())
-        timestamp = datetime.now().isoformat()
+        return self.add_texts([content], [metadata])[0]
+
+    def add_texts(self, contents, metadatas):
+        """Add several text entries to the vector store in one batch"""
+        message_ids, documents, metadatas, ids = self._prepare_entries(contents, metadatas)
+        self._add_batch(documents, metadatas, ids)
+        return message_ids
+
+    def add_texts_deferred(self, contents, metadatas):
+        """Queue text entries for a batched background write and return their IDs.
+
+        The entries become visible to query() once the writer flushes them,
+        either when WRITE_BATCH_SIZE entries are pending or after
+        WRITE_FLUSH_INTERVAL seconds. Call flush() to force it.
+        """
+        message_ids, documents, metadatas, ids = self._prepare_entries(contents, metadatas)
+        self._get_writer().put(documents, metadatas, ids)
+        return message_ids
+
+    def flush(self):
+        """Block until all deferred writes have reached the collection.
+
+        Raises RuntimeError if some had to be dropped after WRITE_RETRIES
+        failed attempts.
+        """
+        if self._writer is not None:
+            self._writer.flush()
+
+    def dropped_writes(self):
+        """Number of deferred entries dropped since the last call, without waiting for the writer"""
+        return self._writer.take_dropped() if self._writer is not None else 0
+
+    def close(self):
+        """Drain deferred writes and stop the background writer"""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+    def _get_writer(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = WriteBehindQueue(self)
+                atexit.register(self.close)
+            return self._writer
+
+    def _prepare_entries(self, contents, metadatas):
+        """Assign IDs and metadata, splitting long contents into chunks.
+
+        Returns (message_ids, documents, metadatas, ids): one ID per input
+        message, then the flattened documents actually stored. A message that
+        fits in one chunk is stored under its own ID; longer ones are stored
+        as chunks linked to it through parent_id. With DEDUPLICATE the ID is
+        derived from the content, so a message repeated in the same session
+        gets the ID it was stored under before.
+        """
+        now = datetime.now()
+        timestamp = now.isoformat()
+        message_ids, documents, entry_metadatas, ids = [], [], [], []
+        for content, metadata in zip(contents, metadatas):
+            if DEDUPLICATE:
+                message_id = content_id(content, metadata.get("role"), metadata.get("session"))
+            else:
+                message_id = str(uuid.uuid4())
+            message_ids.append(message_id)
+            # created_at is numeric so it can be range-filtered, unlike timestamp.
+            # Callers writing on behalf of older content (e.g. summaries) may
+            # supply their own created_at.
+            if "created_at" in metadata:
+                created_at = metadata["created_at"]
+                base = {**metadata, "timestamp": datetime.fromtimestamp(created_at).isoformat()}
+            else:
+                base = {**metadata, "timestamp": timestamp, "created_at": now.timestamp()}
+            base.update({"ref_count": 1, "last_seen": base["created_at"]})
+            
+            chunks = split_text(content)
+            for index, chunk in enumerate(chunks):
+                # tokens is saved so prompt packing doesn't re-measure the text every query
+                entry = {**base, "tokens": estimate_tokens(chunk)}
+                if len(chunks) > 1:
+                    entry.update({"parent_id": message_id, "chunk_index": index, "chunk_count": len(chunks)})
+                    ids.append(chunk_id(message_id, index))
+                else:
+                    ids.append(message_id)
+                documents.append(chunk)
+                entry_metadatas.append(entry)
+        return message_ids, documents, entry_metadatas, ids
+
+    def _near_duplicate(self, content, role, session):
+        """(ID, metadata) of a stored single-chunk message of the same session and role within
+        DEDUPE_NEAR_DISTANCE, or None"""
+        if len(content) > CHUNK_SIZE or not self.collection.count():
+            return None
+        # The embedding is cached, so writing the entry afterwards doesn't encode it again
+        results = self.collection.query(
+            query_embeddings=self.embed([content]),
+            n_results=1,
+            where=metadata_filter(role=role, session=session),
+            include=["metadatas", "distances"]
+        )
+        if not results['ids'][0]:
+            return None
+        metadata, distance = results['metadatas'][0][0], results['distances'][0][0]
+        if distance > DEDUPE_NEAR_DISTANCE or "parent_id" in metadata:
+            return None
+        logger.debug("Near duplicate of %s (distance %.4f)", results['ids'][0][0], distance)
+        return results['ids'][0][0], metadata
+
+    def _merge_duplicates(self, contents, metadatas, ids):
+        """Count entries that are already stored, or repeated in the batch, instead of writing them again.
+
+        With DEDUPE_NEAR_DISTANCE, a new single-chunk entry close enough to a
+        stored one is counted against that entry too, and its own ID is never
+        stored. This runs on the writer thread, off the reply path. Stored
+        entries get their ref_count raised and last_seen moved forward.
+        Returns the contents, metadatas and ids still to be written.
+        """
+        pending = {}
+        for content, metadata, id_ in zip(contents, metadatas, ids):
+            if id_ in pending:
+                first = pending[id_][1]
+                first["ref_count"] += 1
+                first["last_seen"] = max(first["last_seen"], metadata["last_seen"])
+            else:
+                pending[id_] = (content, dict(metadata))
+        
+        stored = self.collection.get(ids=list(pending), include=["metadatas"])
+        targets = dict(zip(stored['ids'], stored['metadatas']))
+        repeats = {id_: id_ for id_ in stored['ids']}  # Pending ID -> stored ID it repeats
+        if DEDUPE_NEAR_DISTANCE is not None:
+            for id_, (content, metadata) in pending.items():
+                if id_ in repeats or "parent_id" in metadata:
+                    continue
+                match = self._near_duplicate(content, metadata.get("role"), metadata.get("session"))
+                if match is not None:
+                    repeats[id_] = match[0]
+                    targets.setdefault(*match)
+        
+        if repeats:
+            updates = {}
+            for id_, target in repeats.items():
+                new = pending.pop(id_)[1]
+                old = updates.get(target) or {
+                    "ref_count": targets[target].get("ref_count", 1),
+                    "last_seen": targets[target].get("last_seen", targets[target].get("created_at", 0)),
+                }
+                updates[target] = {
+                    "ref_count": old["ref_count"] + new["ref_count"],
+                    "last_seen": max(old["last_seen"], new["last_seen"]),
+                }
+            self.collection.update(ids=list(updates), metadatas=list(updates.values()))
+            self.change_log.record(list(updates), self._shard_keys([targets[target] for target in updates]))
+            logger.debug("Counted %d already stored entries: %s", len(updates), ", ".join(updates))
+        DUPLICATES_MERGED.inc(len(ids) - len(pending))
+        
+        return ([content for content, _ in pending.values()],
+                [metadata for _, metadata in pending.values()],
+                list(pending))
+
+    def embed(self, texts):
+        """Return embeddings for texts, encoding only those not already cached"""
+        keys = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        embeddings = [self._embedding_cache.get(key) for key in keys]
+        
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        EMBEDDING_CACHE_REQUESTS.inc(len(texts) - len(missing), result="hit")
+        EMBEDDING_CACHE_REQUESTS.inc(len(missing), result="miss")
+        if missing:
+            with span("embedding"):
+                computed = self.embedding_function([texts[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+                self._embedding_cache.put(keys[i], embedding)
         
+        return embeddings
+
+    def _add_batch(self, contents, metadatas, ids):
         try:
-            self.collection.add(
-                documents=[content],
-                metadatas=[{**metadata, "timestamp": timestamp}],
-                ids=[message_id]
-            )
-            if DEBUG_PRINTS:
-                print(f"Added text to vector store with ID: {message_id}")
-            return message_id
+            if DEDUPLICATE:
+                contents, metadatas, ids = self._merge_duplicates(contents, metadatas, ids)
+                if not ids:
+                    return
+            embeddings = self.embed(contents)
+            with span("store_write"):
+                self.collection.add(
+                    documents=contents,
+                    embeddings=embeddings,
+                    metadatas=metadatas,
+                    ids=ids
+                )
+                shards = self._shard_keys(metadatas)
+                self.lexical_index.add(ids, contents, shards)
+                self._query_cache.invalidate(embeddings, contents)
+                self.change_log.record(ids, shards)
+            ENTRIES_WRITTEN.inc(len(ids))
+            logger.debug("Added %d entries to vector store: %s", len(ids), ", ".join(ids))
         except Exception as e:
-            if DEBUG_PRINTS:
-                print(f"Error adding text to vector store: {e}")
+            logger.error("Error adding text to vector store: %s", e)
             raise
 
-    def query(self, query_text, n_results=CONTEXT_WINDOW):
-        """Query the vector store for similar texts"""
-        try:
-            if DEBUG_PRINTS:
-                print("\n=== Querying Vector Store ===")
-                print(f"Query: {query_text}")
-                print(f"Max results: {n_results}")
-                print(f"Similarity threshold: {SIMILARITY_THRESHOLD}")
-            
+    def search(self, query_text, n_results=CONTEXT_WINDOW, threshold=SIMILARITY_THRESHOLD,
+               since=None, until=None):
+        """Return the stored entries most relevant to query_text as a list of dicts.
+
+        Each dict has id, document, metadata, distance and score keys, best
+        first. Dense hits must be closer than threshold. With HYBRID_SEARCH,
+        BM25 lexical hits are merged in by reciprocal-rank fusion, which
+        catches exact identifiers and names the embedding misses. With
+        PRIORITIZE_RECENT, scores are blended with a time decay. since and
+        until (epoch seconds) restrict the search to entries written in that
+        window before the HNSW search runs. Results are cached until a write
+        could change them.
+        """
+        cache_key = QueryCache.make_key(query_text, n_results, threshold, since, until)
+        cached, generation = self._query_cache.get(cache_key)
+        if cached is not None:
+            QUERY_CACHE_REQUESTS.inc(result="hit")
+            logger.debug("Query cache hit (%d results)", len(cached))
+            return cached
+        QUERY_CACHE_REQUESTS.inc(result="miss")
+        
+        # Several chunks of one message can match, so fetch extra to still
+        # end up with n_results messages after collapsing them
+        fetch_n = n_results * CHUNK_OVERFETCH
+        if PRIORITIZE_RECENT:
+            # Leave room for recent but slightly less similar entries to rank up
+            fetch_n *= RECENCY_OVERFETCH
+        where = self._time_filter(since, until)
+        query_embedding = self.embed([query_text])[0]
+        with span("vector_search"):
             results = self.collection.query(
-                query_texts=[query_text],
-                n_results=n_results,
+                query_embeddings=[query_embedding],
+                n_results=fetch_n,
+                where=where,
                 include=["documents", "metadatas", "distances"]
             )
+        
+        raw = []
+        if results['documents'] and results['documents'][0]:
+            raw = [
+                {"id": id_, "document": doc, "metadata": meta, "distance": dist}
+                for id_, doc, meta, dist in zip(
+                    results['ids'][0], results['documents'][0],
+                    results['metadatas'][0], results['distances'][0]
+                )
+            ]
+        
+        dense = []
+        for record in raw:
+            logger.debug("Matched: distance %.3f, role %s", record['distance'], record['metadata'].get('role', 'unknown'))
             
-            if not results['documents'] or not results['documents'][0]:
-                if DEBUG_PRINTS:
-                    print("No results found")
-                return None
-                
-            # Format messages with role and apply similarity threshold
-            formatted_messages = []
-            if DEBUG_PRINTS:
-                print("\nMatched messages:")
-            
-            for doc, meta, dist in zip(results['documents'][0], results['metadatas'][0], results['distances'][0]):
-                if DEBUG_PRINTS:
-                    print(f"- Distance: {dist:.3f}, Role: {meta.get('role', 'unknown')}")
-                
-                # Only include if similarity is good enough
-                if dist < SIMILARITY_THRESHOLD:
-                    role = meta.get('role', 'unknown')
-                    timestamp = meta.get('timestamp', '')[:19]  # Get just the date and time, not microseconds
-                    formatted_messages.append(f"[{timestamp}] {role.capitalize()}: {doc}")
-                elif DEBUG_PRINTS:
-                    print("  (Excluded due to similarity threshold)")
-            
-            if DEBUG_PRINTS:
-                print(f"\nReturning {len(formatted_messages)} relevant messages")
-            
-            if formatted_messages:
-                history = "Here are the relevant messages from our conversation history:\n\n"
-                history += "\n".join(formatted_messages)
-                return history
+            # Only include if similarity is good enough
+            if record['distance'] < threshold:
+                dense.append(record)
+            else:
+                logger.debug("  (Excluded due to similarity threshold)")
+        
+        if HYBRID_SEARCH:
+            with span("lexical_search"):
+                lexical = self.lexical_index.search(query_text, fetch_n)
+            records = self._fuse(dense, lexical, query_embedding)
+            if where is not None:
+                records = [r for r in records if self._in_window(r['metadata'], since, until)]
+        else:
+            records = dense
+            for record in records:
+                # Cosine distance runs from 0 to 2
+                record['score'] = 1.0 - record['distance'] / 2
+        if PRIORITIZE_RECENT and records:
+            records = self._apply_recency(records)
+        records = self._collapse_chunks(records)[:n_results]
+        
+        # A new entry can only change the dense results if it lands closer
+        # than the threshold and, when the result list is full, closer than
+        # its furthest member. Any new entry sharing a query term can change
+        # the lexical results.
+        cutoff = threshold
+        if len(raw) >= fetch_n:
+            cutoff = min(cutoff, max(record['distance'] for record in raw))
+        terms = tokenize(query_text) if HYBRID_SEARCH else ()
+        self._query_cache.put(cache_key, records, query_embedding, cutoff, terms, generation)
+        
+        return records
+
+    def _fuse(self, dense, lexical, query_embedding):
+        """Merge dense and lexical rankings with reciprocal-rank fusion"""
+        scores = {}
+        for rank, record in enumerate(dense):
+            scores[record['id']] = scores.get(record['id'], 0.0) + 1.0 / (RRF_K + rank + 1)
+        for rank, (id_, _) in enumerate(lexical):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (RRF_K + rank + 1)
+        
+        records = {record['id']: record for record in dense}
+        missing = [id_ for id_, _ in lexical if id_ not in records]
+        if missing:
+            result = self.collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            query_vector = numpy.asarray(query_embedding, dtype=float)
+            for id_, doc, meta, embedding in zip(
+                result['ids'], result['documents'], result['metadatas'], result['embeddings']
+            ):
+                vector = numpy.asarray(embedding, dtype=float)
+                distance = 1.0 - float(vector @ query_vector) / (
+                    (numpy.linalg.norm(vector) * numpy.linalg.norm(query_vector)) or 1.0
+                )
+                records[id_] = {"id": id_, "document": doc, "metadata": meta, "distance": distance}
+            logger.debug("Added %d lexical-only matches", len(result['ids']))
+        
+        fused = []
+        for id_, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+            if id_ in records:
+                records[id_]['score'] = score
+                fused.append(records[id_])
+        return fused
+
+    @staticmethod
+    def _time_filter(since, until):
+        """Chroma where filter restricting created_at to [since, until)"""
+        conditions = []
+        if since is not None:
+            conditions.append({"created_at": {"$gte": since}})
+        if until is not None:
+            conditions.append({"created_at": {"$lt": until}})
+        if not conditions:
             return None
+        if len(conditions) == 1:
+            return conditions[0]
+        return {"$and": conditions}
+
+    @staticmethod
+    def created_at(metadata):
+        """Epoch seconds an entry was written, falling back to its ISO timestamp"""
+        created = metadata.get('created_at')
+        if created is None and metadata.get('timestamp'):
+            try:
+                created = datetime.fromisoformat(metadata['timestamp']).timestamp()
+            except ValueError:
+                pass
+        return created
+
+    @classmethod
+    def _in_window(cls, metadata, since, until):
+        created = cls.created_at(metadata)
+        if created is None:
+            return False
+        return (since is None or created >= since) and (until is None or created < until)
+
+    @classmethod
+    def _apply_recency(cls, records):
+        """Blend each record's relevance with an exponential decay on its age and re-rank"""
+        now = time.time()
+        top = max(record['score'] for record in records) or 1.0
+        for record in records:
+            created = cls.created_at(record['metadata'])
+            if created is None:
+                decay = 0.0
+            else:
+                age_days = max(0.0, now - created) / 86400
+                decay = 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+            record['score'] = (1 - RECENCY_WEIGHT) * record['score'] / top + RECENCY_WEIGHT * decay
+        return sorted(records, key=lambda record: record['score'], reverse=True)
+
+    def _collapse_chunks(self, records):
+        """Replace chunk hits with their whole parent message, keeping the best distance"""
+        best = {}
+        for record in records:
+            parent_id = record['metadata'].get('parent_id', record['id'])
+            if parent_id not in best:
+                best[parent_id] = record
+        
+        chunked = [record for record in best.values() if 'parent_id' in record['metadata']]
+        if not chunked:
+            return list(best.values())
+        
+        ids = [
+            chunk_id(record['metadata']['parent_id'], index)
+            for record in chunked
+            for index in range(record['metadata']['chunk_count'])
+        ]
+        result = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        chunks = [
+            {"id": id_, "document": doc, "metadata": meta}
+            for id_, doc, meta in zip(result['ids'], result['documents'], result['metadatas'])
+        ]
+        for message in merge_chunks(chunks):
+            # Keep the ranking fields (distance, score) of the best matching chunk
+            hit = best[message['id']]
+            message.update({key: value for key, value in hit.items() if key not in ("id", "document", "metadata")})
+            best[message['id']] = message
+        return list(best.values())
+
+    def query(self, query_text, n_results=CONTEXT_WINDOW, threshold=SIMILARITY_THRESHOLD):
+        """Query the vector store for similar texts"""
+        try:
+            logger.debug("Querying vector store with %d chars (max results %d, similarity threshold %s)",
+                         len(query_text), n_results, threshold)
+            
+            records = self.search(query_text, n_results, threshold)
+            
+            if not records:
+                logger.debug("No results found")
+                return None
+            
+            logger.debug("Returning %d relevant messages", len(records))
+            
+            return self.format_history(records)
             
         except Exception as e:
-            if DEBUG_PRINTS:
-                print(f"Error querying vector store: {e}")
+            logger.error("Error querying vector store: %s", e)
             return None
 
+    def format_history(self, records):
+        """Format search results as a history block for the model prompt"""
+        # Format messages with role
+        formatted_messages = []
+        for record in records:
+            role = record['metadata'].get('role', 'unknown')
+            timestamp = record['metadata'].get('timestamp', '')[:19]  # Get just the date and time, not microseconds
+            formatted_messages.append(f"[{timestamp}] {role.capitalize()}: {record['document']}")
+        
+        history = "Here are the relevant messages from our conversation history:\n\n"
+        history += "\n".join(formatted_messages)
+        return history
+
+    def iter_records(self, where=None, batch_size=SCAN_BATCH_SIZE, include=("documents", "metadatas"),
+                     archived=False):
+        """Yield stored entries one at a time, fetching them from Chroma in batches.
+
+        Records are dicts with an id key plus one key per included field
+        (document, metadata, embedding). They come back in ID order rather than
+        time order, and entries written during the scan may be skipped or
+        repeated. With archived set the archive collection is scanned instead.
+        A sharded collection is scanned shard by shard, skipping shards outside
+        the created_at window of where.
+        """
+        collection = self.archive_collection if archived else self.collection
+        if isinstance(collection, ShardedCollection):
+            collections = collection.collections(*time_window(where))
+        else:
+            collections = [collection]
+        for collection in collections:
+            yield from self._scan(collection, where, batch_size, include)
+
+    @staticmethod
+    def _scan(collection, where=None, batch_size=SCAN_BATCH_SIZE, include=("documents", "metadatas")):
+        fields = {"documents": "document", "metadatas": "metadata", "embeddings": "embedding"}
+        offset = 0
+        while True:
+            batch = collection.get(
+                where=where,
+                limit=batch_size,
+                offset=offset,
+                include=list(include)
+            )
+            ids = batch['ids']
+            for i, id_ in enumerate(ids):
+                record = {"id": id_}
+                for plural, singular in fields.items():
+                    if plural in include:
+                        record[singular] = batch[plural][i]
+                yield record
+            if len(ids) < batch_size:
+                return
+            offset += len(ids)
+
+    def changes_since(self, watermark=0.0, limit=None):
+        """Return entries written after watermark, oldest first, plus the new watermark.
+
+        Pass the returned watermark to the next call to follow the collection
+        as a change feed. Only the new entries are read from Chroma.
+        """
+        changes = self.change_log.since(watermark, limit)
+        return self._records_for_changes(changes), (changes[-1][1] if changes else watermark)
+
+    def latest_records(self, n):
+        """Return the n most recently written entries, oldest first"""
+        return self._records_for_changes(self.change_log.latest(n))
+
+    def _records_for_changes(self, changes):
+        if not changes:
+            return []
+        ids = [id_ for id_, _ in changes]
+        result = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        found = {
+            id_: {"id": id_, "document": doc, "metadata": meta}
+            for id_, doc, meta in zip(result['ids'], result['documents'], result['metadatas'])
+        }
+        # Entries deleted since they were logged are skipped
+        return [found[id_] for id_ in ids if id_ in found]
+
+    def delete(self, ids):
+        """Remove entries by ID from the collection and the indexes kept beside it"""
+        if not ids:
+            return
+        self.collection.delete(ids=ids)
+        self.lexical_index.remove(ids)
+        self.change_log.remove(ids)
+        self._query_cache.clear()
+        logger.debug("Deleted %d entries from vector store", len(ids))
+
+    def shards(self):
+        """Keys of the time shards, oldest first, e.g. ["2025_01", "2025_02"]; empty without SHARD_BY"""
+        if isinstance(self.collection, ShardedCollection):
+            return self.collection.shards()
+        return []
+
+    def drop_shard(self, key):
+        """Delete every entry of one time shard, e.g. drop_shard("2025_01"), and return how many there were.
+
+        The shard's collection is deleted whole, and the BM25 index and change
+        log drop its rows with one DELETE each on their shard column, so no
+        entry is visited individually.
+        """
+        if not isinstance(self.collection, ShardedCollection):
+            raise RuntimeError("drop_shard needs SHARD_BY to be set")
+        self.flush()
+        count = self.collection.drop_shard(key)
+        self.lexical_index.drop_shard(key)
+        self.change_log.drop_shard(key)
+        self._query_cache.clear()
+        logger.info("Dropped shard %s (%d entries)", key, count)
+        return count
+
+    @property
+    def archive_collection(self):
+        """Collection holding raw entries that were replaced by summaries"""
+        if self._archive_collection is None:
+            self._archive_collection = self.client.get_or_create_collection(
+                name=ARCHIVE_COLLECTION_NAME,
+                metadata={"hnsw:space": "cosine", "embedding_model": self.embedding_function.model_name},
+                embedding_function=self.embedding_function
+            )
+        return self._archive_collection
+
+    def archive_records(self, records):
+        """Copy records, including their embeddings, into the archive collection"""
+        self.import_records(records, archived=True)
+
+    def import_records(self, records, archived=False):
+        """Write records exported from another store, keeping their IDs.
+
+        Records carrying an embedding are stored with it as-is, so only
+        records without one are embedded. Existing entries with the same ID
+        are replaced.
+        """
+        if not records:
+            return
+        ids = [record['id'] for record in records]
+        documents = [record['document'] for record in records]
+        missing = [i for i, record in enumerate(records) if record.get('embedding') is None]
+        computed = self.embed([documents[i] for i in missing]) if missing else []
+        embeddings = [record.get('embedding') for record in records]
+        for i, embedding in zip(missing, computed):
+            embeddings[i] = embedding
+        
+        collection = self.archive_collection if archived else self.collection
+        collection.upsert(
+            ids=ids,
+            documents=documents,
+            embeddings=embeddings,
+            metadatas=[record['metadata'] for record in records]
+        )
+        if not archived:
+            shards = self._shard_keys([record['metadata'] for record in records])
+            self.lexical_index.add(ids, documents, shards)
+            self._query_cache.clear()
+            self.change_log.record(ids, shards)
+
+    def get_archived(self, session_id):
+        """Return the archived raw entries of a compacted session"""
+        result = self.archive_collection.get(where={"session": session_id}, include=["documents", "metadatas"])
+        return [
+            {"id": id_, "document": doc, "metadata": meta}
+            for id_, doc, meta in zip(result['ids'], result['documents'], result['metadatas'])
+        ]
+
+    def rebuild_lexical_index(self):
+        """Rebuild the BM25 index from the documents in the collection"""
+        logger.info("Building lexical index from existing documents...")
+        self.lexical_index.clear()
+        if isinstance(self.collection, ShardedCollection):
+            sources = self.collection.keyed_collections()
+        else:
+            sources = [("", self.collection)]
+        for shard, collection in sources:
+            batch_ids, batch_docs = [], []
+            for record in self._scan(collection, include=("documents",)):
+                batch_ids.append(record['id'])
+                batch_docs.append(record['document'])
+                if len(batch_ids) >= SCAN_BATCH_SIZE:
+                    self.lexical_index.add(batch_ids, batch_docs, [shard] * len(batch_ids))
+                    batch_ids, batch_docs = [], []
+            if batch_ids:
+                self.lexical_index.add(batch_ids, batch_docs, [shard] * len(batch_ids))
+        self._query_cache.clear()
+        logger.info("Indexed %d documents", len(self.lexical_index))
+
+    def cache_stats(self):
+        """Return hit/miss counters for the query result cache"""
+        return self._query_cache.stats()
+
     def reset_database(self):
         """Safely reset the database by deleting and recreating the collection"""
         try:
+            # Let pending writes land first so they don't outlive the reset
+            self.flush()
+            
             # Delete the existing collection
-            self.client.delete_collection(COLLECTION_NAME)
-            if DEBUG_PRINTS:
-                print(f"Deleted collection '{COLLECTION_NAME}'")
+            self._query_cache.clear()
+            if isinstance(self.collection, ShardedCollection):
+                self.collection.drop_all()
+            else:
+                self.client.delete_collection(COLLECTION_NAME)
+            self.change_log.clear()
+            self.lexical_index.clear()
+            try:
+                self.client.delete_collection(ARCHIVE_COLLECTION_NAME)
+            except ValueError:
+                pass  # Nothing has been archived yet
+            self._archive_collection = None
+            logger.info("Deleted collection '%s'", COLLECTION_NAME)
             
             # Create a new collection
-            self.collection = self.client.create_collection(
-                name=COLLECTION_NAME,
-                metadata={"hnsw:space": "cosine"}
-            )
-            if DEBUG_PRINTS:
-                print(f"Created new collection '{COLLECTION_NAME}'")
+            self.collection = self._open_collection()
+            logger.info("Created new collection '%s'", COLLECTION_NAME)
             
             return True
         except Exception as e:
-            if DEBUG_PRINTS:
-                print(f"Error resetting database: {e}")
+            logger.error("Error resetting database: %s", e)
             return False
@@ -1,6 +1,6 @@
 import chromadb
 from chromadb.config import Settings
-from chromadb.utils import embedding_functions
+from embeddings import create_embedding_function
 import uuid
 from datetime import datetime
 import os
@@ -24,9 +24,8 @@ class VectorStore:
             print("VectorStore: Initializing embedding function...")
             try:
                 # Using a smaller, more stable model
-                self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-                    model_name="paraphrase-MiniLM-L3-v2",
-                    device="cpu"  # Explicitly use CPU
+                self.embedding_function = create_embedding_function(
+                    "sentence-transformers", "paraphrase-MiniLM-L3-v2"
                 )
                 print("VectorStore: Embedding function initialized successfully")
             except Exception as e:
@@ -1,6 +1,8 @@
 """Script to watch the vector database in real-time"""
 
 from vector_store import VectorStore
+from chunking import merge_chunks
+from collections import deque
 import time
 from datetime import datetime
 import os
@@ -10,48 +12,50 @@ def clear_screen():
     """Clear the terminal screen"""
     os.system('cls' if os.name == 'nt' else 'clear')
 
-def watch_database(refresh_rate=2):
+def watch_database(refresh_rate=2, show_latest=5):
     """Watch the database for changes with a specified refresh rate in seconds"""
     store = VectorStore()
-    last_count = 0
+    
+    # Seed the display, then follow the change feed so each tick only
+    # reads the entries written since the last one
+    watermark = time.time()
+    latest = deque(merge_chunks(store.latest_records(show_latest)), maxlen=show_latest)
     
     try:
         while True:
-            clear_screen()
+            new_records, watermark = store.changes_since(watermark)
+            new_records = merge_chunks(new_records)
+            latest.extend(new_records)
+            current_count = store.collection.count()
             
-            # Get all documents
-            result = store.collection.get()
-            current_count = len(result['documents'])
+            clear_screen()
             
             # Print header
             print(f"\n=== ChromaDB Watch ({datetime.now().strftime('%H:%M:%S')}) ===")
             print(f"Documents in database: {current_count}")
             
             # Show if there are new entries
-            if current_count > last_count:
-                print(f"\n[+] {current_count - last_count} new entries added!")
+            if new_records:
+                print(f"\n[+] {len(new_records)} new entries added!")
             
-            if current_count > 0:
+            if latest:
                 print("\nLatest conversations:")
                 print("-" * 50)
                 
-                # Sort by timestamp
-                sorted_items = list(zip(result['documents'], result['metadatas']))
-                sorted_items.sort(key=lambda x: x[1].get('timestamp', ''), reverse=True)
-                
-                # Show the 5 most recent entries
-                for doc, meta in sorted_items[:5]:
+                # Newest first
+                for record in reversed(latest):
+                    meta = record['metadata']
                     print(f"\nTimestamp: {meta.get('timestamp', 'N/A')}")
                     print(f"Session: {meta.get('session', 'N/A')}")
                     try:
                         # Truncate long messages
+                        doc = record['document']
                         content = doc if len(doc) < 100 else doc[:97] + "..."
                         print(f"Content: {content}")
                     except UnicodeEncodeError:
                         print("Content: [Unicode encoding error]")
                     print("-" * 50)
             
-            last_count = current_count
             time.sleep(refresh_rate)
             
     except KeyboardInterrupt: